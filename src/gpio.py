@@ -24,21 +24,61 @@
 Library for interfacing with Linux GPIO character device API
 """
 
+# The library is deliberately a single module without dependencies.
+# pylint: disable=too-many-lines
+
 __version__ = "0.0.0-alpha1"
 
-from fcntl import ioctl
+from array import array
+import errno
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from fcntl import F_SETPIPE_SZ, fcntl, ioctl
 from ctypes import (
+    CDLL,
+    Array,
     Structure,
     Union,
+    byref,
     c_char,
     c_int32,
+    c_long,
     c_uint32,
     c_uint64,
+    get_errno,
+    memmove,
+    memset,
     sizeof,
+    addressof,
 )
-from io import FileIO
+from enum import IntEnum
+from glob import glob
+from functools import partial
+from io import BufferedWriter, FileIO
+from itertools import chain
+import mmap
+import os
 import select
-from typing import Dict, List, Optional
+import socket
+import struct
+import sys
+import threading
+import time
+import weakref
+import typing
+from typing import (
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 ############################################################################
 # Userspace declarations:
@@ -218,339 +258,4085 @@ GPIO_V2_LINE_GET_VALUES_IOCTL = 0xC010B40E  # L515
 GPIO_V2_LINE_SET_VALUES_IOCTL = 0xC010B40F  # L516
 
 ##################################################################################
+# timerfd declarations:
+# https://man7.org/linux/man-pages/man2/timerfd_create.2.html
 
-U32_MAX = 0xFFFFFFFF
+TFD_CLOEXEC = 0o2000000
 
-U64_MAX = 0xFFFFFFFFFFFFFFFF
+TFD_TIMER_ABSTIME = 1
 
 
-class Lines:
-    """
-    Abstraction over a set of configured GPIO lines.
-    """
+class timespec(Structure):
+    _fields_ = [
+        ("tv_sec", c_long),
+        ("tv_nsec", c_long),
+    ]
 
-    def __init__(self, fd, offsets):
-        """
-        Constructor is subject to change; do not use.
-        """
-        self._epoll = None
-        self._file = FileIO(fd)
-        self._bit_offsets = dict((v, i) for (i, v) in enumerate(offsets))
-        self._values = gpio_v2_line_values()
 
-    def get_bits_unchecked(self, mask: int) -> int:
-        """
-        Get GPIO line states as a bitmask without checking for overflow.
-        """
-        self._values.bits = 0
-        self._values.mask = mask
-        ioctl(self._file.fileno(), GPIO_V2_LINE_GET_VALUES_IOCTL, self._values)
-        return self._values.bits
+class itimerspec(Structure):
+    _fields_ = [
+        ("it_interval", timespec),
+        ("it_value", timespec),
+    ]
 
-    def set_bits_unchecked(self, bits: int, mask: int):
-        """
-        Set GPIO line states from a bitmask without checking for overflow.
-        """
-        self._values.bits = bits
-        self._values.mask = mask
-        ioctl(self._file.fileno(), GPIO_V2_LINE_SET_VALUES_IOCTL, self._values)
 
-    def get_bits(self, mask: int) -> int:
-        """
-        Lower-level function to directly get GPIO line states as a bitmask.
-        """
-        assert 0 <= mask <= U64_MAX, "mask out of range"
-        return self.get_bits_unchecked(mask)
+##################################################################################
 
-    def set_bits(self, bits: int, mask: int):
-        """
-        Lower-level function to directly set GPIO line states from a bitmask.
-        """
-        assert 0 <= bits <= U64_MAX, "bits out of range"
-        assert 0 <= mask <= U64_MAX, "mask out of range"
-        self.set_bits_unchecked(bits, mask)
+U32_MAX = 0xFFFFFFFF
 
-    def get(self) -> Dict[int, bool]:
-        """
-        Convenience function to get GPIO line states as a dict of offsets and values.
-        """
-        bits = self.get_bits(U64_MAX)
-        return dict((k, bool(bits & 1 << v)) for (k, v) in self._bit_offsets.items())
+U64_MAX = 0xFFFFFFFFFFFFFFFF
 
-    def set(self, values: Dict[int, bool]):
-        """
-        Convenience function to set GPIO line states from a dict of offsets and values.
-        """
-        bits = 0
-        mask = 0
+RECORDING_MAGIC = b"GPIOREC"
 
-        for k, v in values.items():
-            offset = int(k)
-            assert offset in self._bit_offsets, f"offset {offset} not configured"
-            shift = self._bit_offsets[offset]
-            bits |= bool(v) << shift
-            mask |= 1 << shift
+RECORDING_VERSION = 1
 
-        self.set_bits(bits, mask)
 
-    def set_config(
-        self, flags: Optional[List[str]] = None, attrs: Optional[List[Dict]] = None
-    ):
+class _recording_header(Structure):
+    _pack_ = 8
+    _fields_ = [
+        ("magic", c_char * 8),
+        ("version", c_uint32),
+        ("num_lines", c_uint32),
+        ("realtime_ns", c_uint64),
+        ("monotonic_ns", c_uint64),
+        ("chip", c_char * GPIO_MAX_NAME_SIZE),
+        ("offsets", c_uint32 * GPIO_V2_LINES_MAX),
+    ]
+
+
+class _Kernel:
+    ioctl = staticmethod(ioctl)
+
+    @staticmethod
+    def open(path):
         """
-        Reconfigure this set of GPIO lines.
+        Open a GPIO character device.
         """
-        attrs = list(Chip._build_attrs(attrs or []))
-        num_attrs = len(attrs)
-        config = gpio_v2_line_config(
-            flags=Chip._build_flags(flags), num_attrs=num_attrs
-        )
-        config.attrs[:num_attrs] = attrs
-        ioctl(self._file.fileno(), GPIO_V2_LINE_SET_CONFIG_IOCTL, config)
+        return os.open(path, os.O_RDONLY | os.O_CLOEXEC)
 
-    def wait(self, timeout: Optional[float] = None) -> Optional[Dict]:
+    @staticmethod
+    def release(fd):
         """
-        Wait for the next edge event on this set of GPIO lines.
+        Nothing to do; the kernel releases lines when the fd is closed.
         """
-        if not self._epoll:
-            self._epoll = select.epoll()
-            fd = self._file.fileno()
-            self._epoll.register(fd, select.EPOLLIN)
 
-        fds = self._epoll.poll(timeout=timeout)
 
-        if not fds:
-            return None
+_kernel = _Kernel()
 
-        assert not fds[0][1] & select.EPOLLERR, "EPOLLERR"
-        event = gpio_v2_line_event()
-        ret = self._file.readinto(event)
-        assert ret == sizeof(gpio_v2_line_event)
 
-        return {
-            "timestamp_ns": event.timestamp_ns,
-            "id": "RISING_EDGE"
-            if event.id == GPIO_V2_LINE_EVENT_RISING_EDGE
-            else "FALLING_EDGE"
-            if event.id == GPIO_V2_LINE_EVENT_FALLING_EDGE
-            else "???",
-            "offset": event.offset,
-            "seqno": event.seqno,
-            "line_seqno": event.line_seqno,
-        }
+def _asyncio():
+    # Imported on first use; it would otherwise dominate the import time of this module.
+    import asyncio  # pylint: disable=import-outside-toplevel
 
+    return asyncio
 
-class Chip:
-    """
-    Abstraction over one logical device that manages multiple GPIO lines.
-    """
 
-    _flags = dict(
-        (k, v) for (k, v) in globals().items() if k.startswith("GPIO_V2_LINE_FLAG_")
-    )
+_readers: Dict[Tuple[object, int], object] = {}
 
-    def __init__(self, path):
-        """
-        Constructor is subject to change; do not use.
-        """
-        self._epoll = None
-        self._file = FileIO(path)
 
-    def _get_chip_info(self):
-        chip_info = gpiochip_info()
-        ioctl(self._file.fileno(), GPIO_GET_CHIPINFO_IOCTL, chip_info)
-        return chip_info
+@contextmanager
+def _reader(fd):
+    # The reader stays registered while the caller iterates, so waking up costs no
+    # epoll_ctl; the event is set again after each read for as long as fd is readable.
+    # An iterator left with break is only closed later by the loop, so the reader is
+    # removed only if no later wait on the same fd has replaced it since.
+    asyncio = _asyncio()
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    loop.add_reader(fd, ready.set)
+    _readers[(loop, fd)] = ready
 
-    def _get_line_info(self, offset):
-        line_info = gpio_v2_line_info(offset=offset)
-        ioctl(self._file.fileno(), GPIO_V2_GET_LINEINFO_IOCTL, line_info)
-        return line_info
+    try:
+        yield ready
+    finally:
+        if _readers.get((loop, fd)) is ready:
+            del _readers[(loop, fd)]
+            loop.remove_reader(fd)
 
-    def _get_line(self, offsets, consumer, flags, attrs, event_buffer_size=0):
-        num_lines = len(offsets)
-        num_attrs = len(attrs)
-        config = gpio_v2_line_config(flags=flags, num_attrs=num_attrs)
-        config.attrs[:num_attrs] = attrs
 
-        request = gpio_v2_line_request(
-            config=config,
-            num_lines=num_lines,
-            event_buffer_size=event_buffer_size,
-        )
+async def _readable(ready, fd, timeout=None):
+    asyncio = _asyncio()
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
 
-        if consumer:
-            request.consumer = consumer.encode()
+    while True:
+        remaining = None if deadline is None else max(0.0, deadline - loop.time())
+        await asyncio.wait_for(ready.wait(), remaining)
+        ready.clear()
 
-        request.offsets[:num_lines] = offsets
-        ioctl(self._file.fileno(), GPIO_V2_GET_LINE_IOCTL, request)
-        return request.fd
+        # The reader callback may have run again after the data was already read.
+        # select() checks without setting up an epoll instance per object.
+        if select.select([fd], [], [], 0)[0]:
+            return
 
-    def _iter_lines(self, lines):
-        for i in range(lines):
-            line_info = self._get_line_info(i)
-            yield line_info
 
-    def _iter_flags(self, flags):
-        for name, value in self._flags.items():
-            if flags & value:
-                yield name.replace("GPIO_V2_LINE_FLAG_", "")
+def _numpy():
+    import numpy  # pylint: disable=import-outside-toplevel
 
-    @classmethod
-    def _build_flags(cls, flags):
-        ret = 0
+    return numpy
 
-        if flags:
-            for name in flags:
-                value = cls._flags.get("GPIO_V2_LINE_FLAG_" + name, 0)
-                ret |= value
 
-        return ret
+def _enum_name(enum, value):
+    try:
+        return enum(value).name
+    except ValueError:
+        return "???"
 
-    @staticmethod
-    def _iter_attrs(num_attrs, attrs):
-        for i in range(num_attrs):
-            attr = attrs[i]
 
-            if attr.id == GPIO_V2_LINE_ATTR_ID_FLAGS:
-                yield {"flags": attr.u.flags}
-            elif attr.id == GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES:
-                yield {"values": attr.u.values}
-            elif attr.id == GPIO_V2_LINE_ATTR_ID_DEBOUNCE:
-                yield {"debounce_period_us": attr.u.debounce_period_us}
-            else:
-                pass
+class LineEventId(IntEnum):
+    RISING_EDGE = GPIO_V2_LINE_EVENT_RISING_EDGE
+    FALLING_EDGE = GPIO_V2_LINE_EVENT_FALLING_EDGE
 
-    @classmethod
-    def _build_attrs(cls, attrs):
-        assert len(attrs) <= GPIO_V2_LINE_NUM_ATTRS_MAX, "too many attributes"
 
-        for a in attrs:
-            mask = a["mask"]
-            assert 0 <= mask <= U64_MAX, "mask out of range"
+class LineChangedType(IntEnum):
+    LINE_REQUESTED = GPIO_V2_LINE_CHANGED_REQUESTED
+    LINE_RELEASED = GPIO_V2_LINE_CHANGED_RELEASED
+    CONFIG_CHANGED = GPIO_V2_LINE_CHANGED_CONFIG
 
-            if "flags" in a:
-                flags = cls._build_flags(a["flags"])
-                attr = gpio_v2_line_attribute()
-                attr.id = GPIO_V2_LINE_ATTR_ID_FLAGS
-                attr.u.flags = flags
-                yield gpio_v2_line_config_attribute(mask=mask, attr=attr)
-            elif "values" in a:
-                values = a["values"]
-                assert 0 <= values <= U64_MAX, "values out of range"
-                attr = gpio_v2_line_attribute()
-                attr.id = GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES
-                attr.u.values = values
-                yield gpio_v2_line_config_attribute(mask=mask, attr=attr)
-            elif "debounce_period_us" in a:
-                attr = gpio_v2_line_attribute()
-                attr.id = GPIO_V2_LINE_ATTR_ID_DEBOUNCE
-                attr.u.debounce_period_us = a["debounce_period_us"]
-                yield gpio_v2_line_config_attribute(mask=mask, attr=attr)
-            else:
-                continue
 
-    def _line_info(self, li):
+class LineEvent(NamedTuple):
+    """
+    Edge event on a GPIO line. The id compares equal to LineEventId members.
+    """
+
+    timestamp_ns: int
+    id: int
+    offset: int
+    seqno: int
+    line_seqno: int
+
+    def as_dict(self) -> Dict:
+        """
+        Get this event as a dict, with the id as a string.
+        """
         return {
-            "name": li.name.decode(errors="replace"),
-            "consumer": li.consumer.decode(errors="replace"),
-            "offset": li.offset,
-            "flags": list(self._iter_flags(li.flags)),
-            "attrs": list(self._iter_attrs(li.num_attrs, li.attrs)),
+            "timestamp_ns": self.timestamp_ns,
+            "id": _enum_name(LineEventId, self.id),
+            "offset": self.offset,
+            "seqno": self.seqno,
+            "line_seqno": self.line_seqno,
         }
 
-    def info(self) -> Dict:
+
+class LineInfoChanged:
+    """
+    Line_info_changed event on a GPIO chip. The line info is decoded on first access.
+    The event_type compares equal to LineChangedType members.
+    """
+
+    __slots__ = ("timestamp_ns", "event_type", "_line_info", "_info")
+
+    def __init__(self, event: gpio_v2_line_info_changed):
+        self.timestamp_ns: int = event.timestamp_ns
+        self.event_type: int = event.event_type
+        self._line_info = event.info
+        self._info: Optional[Dict] = None
+
+    @property
+    def offset(self) -> int:
         """
-        Get all available info on this chip and the lines it manages.
+        Offset of the line that changed.
         """
-        chip_info = self._get_chip_info()
+        return self._line_info.offset
 
-        data = {
-            "name": chip_info.name.decode(errors="replace"),
-            "label": chip_info.name.decode(errors="replace"),
-            "lines": [self._line_info(li) for li in self._iter_lines(chip_info.lines)],
-        }
+    @property
+    def info(self) -> Dict:
+        """
+        Line info as returned for each line by Chip.info().
+        """
+        if self._info is None:
+            self._info = Chip._line_info(self._line_info)
 
-        return data
+        return self._info
 
-    def request(
-        self,
-        offsets: List[int],
-        consumer: Optional[str] = None,
-        flags: Optional[List[str]] = None,
-        attrs: Optional[List[Dict]] = None,
-    ) -> Lines:
+    def as_dict(self) -> Dict:
         """
-        Configure a set of GPIO lines with the given settings.
+        Get this event as a dict, with the event_type as a string.
         """
-        assert len(offsets) <= GPIO_V2_LINES_MAX, "too many lines"
+        return {
+            "info": self.info,
+            "timestamp_ns": self.timestamp_ns,
+            "event_type": _enum_name(LineChangedType, self.event_type),
+        }
 
-        for i in offsets:
-            assert 0 <= i <= U32_MAX, f"offset out of range: {i}"
-            assert offsets.count(i) == 1, f"duplicate offset: {i}"
 
-        fd = self._get_line(
-            offsets,
-            consumer=consumer,
-            flags=self._build_flags(flags),
-            attrs=list(self._build_attrs(attrs or [])),
-        )
+class Metrics:
+    """
+    Counters and timings for the ioctls, waits and edge events of GPIO lines and chips.
+    Attach with Lines.instrument() or Chip.instrument(); one object may be shared.
+    """
 
-        return Lines(fd, offsets)
+    _ioctl_names = dict(
+        (v, k[: -len("_IOCTL")])
+        for (k, v) in globals().items()
+        if k.startswith("GPIO_") and k.endswith("_IOCTL")
+    )
 
-    def watch(self, offset: int):
+    def __init__(self, clock: Callable[[], int] = time.perf_counter_ns):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._hooks: List[Callable[[str, int], None]] = []
+        self._timings: Dict[str, List[int]] = {}
+        self._events = 0
+        self._dropped = 0
+        self._max_batch = 0
+
+    def add_hook(self, callback: Callable[[str, int], None]):
         """
-        Start watching for line_info_changed events on this GPIO chip.
+        Call callback(key, value) for every sample: durations in ns keyed as in
+        snapshot()["timings"], and the number of lost events as "dropped".
         """
-        assert 0 <= offset <= U32_MAX
-        line_info = gpio_v2_line_info(offset=offset)
-        ioctl(self._file.fileno(), GPIO_V2_GET_LINEINFO_WATCH_IOCTL, line_info)
+        self._hooks.append(callback)
 
-    def unwatch(self, offset: int):
+    def remove_hook(self, callback: Callable[[str, int], None]):
         """
-        Stop watching for line_info_changed events on this GPIO chip.
+        Stop calling a callback registered with add_hook().
         """
-        assert 0 <= offset <= U32_MAX
-        c_offset = c_uint32(offset)
-        ioctl(
-            self._file.fileno(),
-            GPIO_GET_LINEINFO_UNWATCH_IOCTL,
-            c_offset,
-        )
+        self._hooks.remove(callback)
 
-    def wait(self, timeout: Optional[float] = None) -> Optional[Dict]:
+    def reset(self):
         """
-        Wait for the next line_info_changed event on this GPIO chip.
+        Clear all counters and timings.
         """
-        if not self._epoll:
-            self._epoll = select.epoll()
-            fd = self._file.fileno()
-            self._epoll.register(fd, select.EPOLLIN)
+        with self._lock:
+            self._timings = {}
+            self._events = 0
+            self._dropped = 0
+            self._max_batch = 0
 
-        fds = self._epoll.poll(timeout=timeout)
+    def snapshot(self) -> dict:
+        """
+        Get a copy of the counters. Timings are keyed by ioctl name, "wait" and
+        "read_events", each with count, total_ns, mean_ns and max_ns.
+        """
+        with self._lock:
+            timings = dict(
+                (k, {"count": n, "total_ns": t, "mean_ns": t // n, "max_ns": m})
+                for (k, (n, t, m)) in self._timings.items()
+            )
 
-        if not fds:
-            return None
+            return {
+                "timings": timings,
+                "events": self._events,
+                "dropped": self._dropped,
+                "max_batch": self._max_batch,
+            }
 
-        assert not fds[0][1] & select.EPOLLERR, "EPOLLERR"
-        event = gpio_v2_line_info_changed()
-        ret = self._file.readinto(event)
-        assert ret == sizeof(gpio_v2_line_info_changed)
-        et = event.event_type
+    def _time(self, key, ns):
+        with self._lock:
+            timing = self._timings.get(key)
 
-        return {
-            "info": self._line_info(event.info),
-            "timestamp_ns": event.timestamp_ns,
-            "event_type": "LINE_REQUESTED"
-            if et == GPIO_V2_LINE_CHANGED_REQUESTED
-            else "LINE_RELEASED"
-            if et == GPIO_V2_LINE_CHANGED_RELEASED
-            else "CONFIG_CHANGED"
-            if et == GPIO_V2_LINE_CHANGED_CONFIG
-            else "???",
-        }
+            if timing is None:
+                self._timings[key] = [1, ns, ns]
+            else:
+                timing[0] += 1
+                timing[1] += ns
+                timing[2] = max(timing[2], ns)
 
+        for hook in self._hooks:
+            hook(key, ns)
 
-def chip(path: str) -> Chip:
-    """
-    Public constructor.
-    """
+    def _call(self, key, func, *args):
+        start = self._clock()
+
+        try:
+            return func(*args)
+        finally:
+            self._time(key, self._clock() - start)
+
+    def _wrap(self, ioctl_func):
+        names = self._ioctl_names
+
+        def timed(request, arg):
+            return self._call(
+                names.get(request, hex(request)), ioctl_func, request, arg
+            )
+
+        return timed
+
+    def _count(self, n, dropped):
+        with self._lock:
+            self._events += n
+            self._dropped += dropped
+            self._max_batch = max(self._max_batch, n)
+
+        if dropped:
+            for hook in self._hooks:
+                hook("dropped", dropped)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of latencies in ns, as in HdrHistogram: each power of two is
+    split into 2**precision linear buckets, for a relative error below 2**-precision.
+    """
+
+    def __init__(self, precision: int = 5):
+        assert 0 < precision <= 16, "precision out of range"
+        self._precision = precision
+        self._counts = array("Q")
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+
+    def _index(self, ns):
+        shift = ns.bit_length() - self._precision - 1
+
+        if shift < 0:
+            return ns
+
+        return ((shift + 1) << self._precision) + (ns >> shift) - (1 << self._precision)
+
+    def _lowest(self, index):
+        shift = (index >> self._precision) - 1
+        sub = index & ((1 << self._precision) - 1)
+
+        if shift < 0:
+            return sub
+
+        return (sub + (1 << self._precision)) << shift
+
+    def record(self, ns: int):
+        """
+        Add one latency sample. Negative samples, e.g. from clock steps, count as 0.
+        """
+        ns = max(ns, 0)
+        index = self._index(ns)
+
+        if index >= len(self._counts):
+            self._counts.extend(array("Q", bytes(8 * (index + 1 - len(self._counts)))))
+
+        self._counts[index] += 1
+
+        if not self.count or ns < self.min_ns:
+            self.min_ns = ns
+
+        self.max_ns = max(self.max_ns, ns)
+        self.count += 1
+        self.total_ns += ns
+
+    def merge(self, other: "LatencyHistogram"):
+        """
+        Add the samples of another histogram with the same precision.
+        """
+        assert other._precision == self._precision, "precision mismatch"
+
+        if len(other._counts) > len(self._counts):
+            pad = len(other._counts) - len(self._counts)
+            self._counts.extend(array("Q", bytes(8 * pad)))
+
+        for i, n in enumerate(other._counts):
+            self._counts[i] += n
+
+        if other.count and (not self.count or other.min_ns < self.min_ns):
+            self.min_ns = other.min_ns
+
+        self.max_ns = max(self.max_ns, other.max_ns)
+        self.count += other.count
+        self.total_ns += other.total_ns
+
+    def percentile(self, p: float) -> int:
+        """
+        Get the latency in ns at or below which p percent of the samples fall.
+        """
+        assert 0 <= p <= 100, "percentile out of range"
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+
+        for i, n in enumerate(self._counts):
+            seen += n
+
+            if seen >= rank:
+                return min(self._lowest(i + 1) - 1, self.max_ns)
+
+        return self.max_ns
+
+    def snapshot(self) -> dict:
+        """
+        Get count, min, mean, max and common percentiles in ns as a dict.
+        """
+        return {
+            "count": self.count,
+            "min_ns": self.min_ns,
+            "mean_ns": self.total_ns // self.count if self.count else 0,
+            "max_ns": self.max_ns,
+        } | dict((f"p{p}_ns", self.percentile(p)) for p in (50, 90, 99, 99.9))
+
+
+class LatencyProfiler:
+    """
+    Edge-to-userspace latency of edge events, as the kernel timestamp against the
+    matching clock at receipt, with one LatencyHistogram per line offset.
+    Attach with Lines.profile(), or feed any event stream to record().
+    """
+
+    def __init__(
+        self,
+        precision: int = 5,
+        realtime: Iterable[int] = (),
+        hte: Iterable[int] = (),
+        hte_clock: Callable[[], int] = time.monotonic_ns,
+    ):
+        """
+        Events of offsets in realtime are compared against CLOCK_REALTIME, those in hte
+        against hte_clock, which must match the timestamp engine, others against
+        CLOCK_MONOTONIC.
+        """
+        self._precision = precision
+        self._hte_clock = hte_clock
+        self.realtime = set(realtime)
+        self.hte = set(hte)
+        self.histograms: Dict[int, LatencyHistogram] = {}
+
+    def record(self, events: Iterable):
+        """
+        Add the latency of events just received, e.g. a batch from Lines.read_events().
+        """
+        monotonic = time.monotonic_ns()
+        realtime = time.time_ns() if self.realtime else 0
+        hte = self._hte_clock() if self.hte else 0
+
+        for event in events:
+            offset = event.offset
+            histogram = self.histograms.get(offset)
+
+            if histogram is None:
+                histogram = self.histograms[offset] = LatencyHistogram(self._precision)
+
+            if offset in self.realtime:
+                histogram.record(realtime - event.timestamp_ns)
+            elif offset in self.hte:
+                histogram.record(hte - event.timestamp_ns)
+            else:
+                histogram.record(monotonic - event.timestamp_ns)
+
+    def total(self) -> LatencyHistogram:
+        """
+        Get a histogram of all lines combined.
+        """
+        total = LatencyHistogram(self._precision)
+
+        for histogram in self.histograms.values():
+            total.merge(histogram)
+
+        return total
+
+    def snapshot(self) -> Dict[int, dict]:
+        """
+        Get the summary of each line's histogram, keyed by offset.
+        """
+        return dict((k, v.snapshot()) for (k, v) in sorted(self.histograms.items()))
+
+    def reset(self):
+        """
+        Discard all samples.
+        """
+        self.histograms = {}
+
+
+class Debouncer:
+    """
+    Software debounce of edge events using their kernel timestamps. Per line, a burst
+    of edges less than the period apart is collapsed into its last edge, which is
+    released once the line has been stable for the period, and only if it changes
+    the level last released. Events of other lines pass through unchanged.
+    """
+
+    def __init__(
+        self,
+        periods_ns: Dict[int, int],
+        levels: Optional[Dict[int, int]] = None,
+        realtime: Iterable[int] = (),
+    ):
+        """
+        periods_ns maps offsets to their debounce period, levels to their current
+        level if known. Events of offsets in realtime use CLOCK_REALTIME timestamps.
+        """
+        self.periods_ns = dict(periods_ns)
+        self.realtime = set(realtime)
+        self.suppressed = 0
+        self._pending: Dict[int, LineEvent] = {}
+        self._ready: Deque[LineEvent] = deque()
+        self._levels = dict(
+            (k, LineEventId.RISING_EDGE if v else LineEventId.FALLING_EDGE)
+            for (k, v) in (levels or {}).items()
+        )
+
+    def feed(self, events: Iterable):
+        """
+        Add a batch of edge events, e.g. from Lines.read_events().
+        """
+        for event in events:
+            offset = event.offset
+            event = LineEvent(
+                event.timestamp_ns, event.id, offset, event.seqno, event.line_seqno
+            )
+            period = self.periods_ns.get(offset)
+
+            if period is None:
+                self._ready.append(event)
+                continue
+
+            pending = self._pending.get(offset)
+
+            if pending is not None:
+                if event.timestamp_ns - pending.timestamp_ns >= period:
+                    self._release(pending)
+                else:
+                    self.suppressed += 1
+
+            self._pending[offset] = event
+
+    def _release(self, event):
+        if self._levels.get(event.offset) == event.id:
+            self.suppressed += 1
+        else:
+            self._levels[event.offset] = event.id
+            self._ready.append(event)
+
+    def _now(self):
+        monotonic = time.monotonic_ns()
+        realtime = time.time_ns() if self.realtime else 0
+        return lambda offset: realtime if offset in self.realtime else monotonic
+
+    def take(self, max_events: int) -> List[LineEvent]:
+        """
+        Release edges whose line has been stable for the period, and get up to
+        max_events filtered events.
+        """
+        if self._pending:
+            now = self._now()
+
+            for offset, event in list(self._pending.items()):
+                if now(offset) - event.timestamp_ns >= self.periods_ns[offset]:
+                    del self._pending[offset]
+                    self._release(event)
+
+        n = min(max_events, len(self._ready))
+        return [self._ready.popleft() for _ in range(n)]
+
+    def timeout(self) -> Optional[float]:
+        """
+        Get the time in seconds until the next held edge is due, or None if none is held.
+        """
+        if not self._pending:
+            return None
+
+        now = self._now()
+        due = min(
+            event.timestamp_ns + self.periods_ns[offset] - now(offset)
+            for (offset, event) in self._pending.items()
+        )
+        return max(due, 0) / 1e9
+
+
+# State for the optional per-request layers (batching, shadow copy, metrics,
+# latency profiling and debounce) lives here to keep the hot paths attribute reads.
+class Lines:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """
+    Abstraction over a set of configured GPIO lines.
+    """
+
+    def __init__(
+        self,
+        fd,
+        offsets,
+        *,
+        shadow=None,
+        backend=None,
+        event_clocks=(0, 0),
+        outputs=U64_MAX,
+    ):
+        """
+        Constructor is subject to change; do not use.
+        """
+        backend = backend or _kernel
+        self._epoll = None
+        self._file = FileIO(fd)
+        self._ioctl = partial(backend.ioctl, fd)
+        self._backend = backend
+        self._release = weakref.finalize(self, backend.release, fd)
+        self._bit_offsets = dict((v, i) for (i, v) in enumerate(offsets))
+        self._values = gpio_v2_line_values()
+        self._shadow = shadow
+        self._batch = 0
+        self._pending_bits = 0
+        self._pending_mask = 0
+        self._events = (gpio_v2_line_event * 0)()
+        self._metrics = None
+        self._seqno = 0
+        self._event_clocks = event_clocks
+        self._outputs = outputs
+        self._profiler = None
+        self._debouncer = None
+
+    def fileno(self) -> int:
+        """
+        Get the file descriptor of this line request, e.g. for use with select.
+        """
+        return self._file.fileno()
+
+    def close(self):
+        """
+        Release this set of GPIO lines.
+        """
+        if self._epoll:
+            self._epoll.close()
+
+        self._release()
+        self._file.close()
+
+    def instrument(self, metrics: Optional[Metrics] = None) -> Metrics:
+        """
+        Record ioctls, waits and edge events into metrics, or into a new Metrics.
+        Accessors returned by fast() bind the ioctl path, so create them afterwards.
+        """
+        if metrics is None:
+            metrics = Metrics()
+
+        self._ioctl = metrics._wrap(partial(self._backend.ioctl, self._file.fileno()))
+        self._metrics = metrics
+        self._seqno = 0
+        return metrics
+
+    def uninstrument(self):
+        """
+        Stop recording into the Metrics given to instrument().
+        """
+        self._ioctl = partial(self._backend.ioctl, self._file.fileno())
+        self._metrics = None
+
+    def profile(self, profiler: Optional[LatencyProfiler] = None) -> LatencyProfiler:
+        """
+        Record the latency of edge events read from these lines into profiler, or into
+        a new LatencyProfiler, using the event clock each line was configured with.
+        """
+        if profiler is None:
+            profiler = LatencyProfiler()
+
+        self._profiler = profiler
+        self._update_clocks()
+        return profiler
+
+    def unprofile(self):
+        """
+        Stop recording into the LatencyProfiler given to profile().
+        """
+        self._profiler = None
+
+    def debounce(self, period_us: int, offsets: Optional[List[int]] = None):
+        """
+        Debounce edge events of the given lines, by default all, in software, for chips
+        without hardware debounce. A period of 0 disables it. Applies to wait(),
+        read_events(), wait_async(), events(), Selector, Counter and QuadratureDecoder,
+        but not to Capture.
+        """
+        assert 0 <= period_us <= U32_MAX, "period_us out of range"
+        periods = dict(self._debouncer.periods_ns) if self._debouncer else {}
+
+        for offset in offsets if offsets is not None else self._bit_offsets:
+            if period_us:
+                periods[offset] = period_us * 1000
+            else:
+                periods.pop(offset, None)
+
+        if not periods:
+            self._debouncer = None
+            return
+
+        bits = self.get_bits(sum(1 << self._bit_offsets[k] for k in periods))
+        self._debouncer = Debouncer(
+            periods,
+            dict((k, bits >> self._bit_offsets[k] & 1) for k in periods),
+            (
+                k
+                for (k, i) in self._bit_offsets.items()
+                if self._event_clocks[0] >> i & 1
+            ),
+        )
+
+    def _debounced(self):
+        return self._debouncer.periods_ns if self._debouncer is not None else {}
+
+    def _debounce_timeout(self, deadline):
+        timeout = self._debouncer.timeout()
+
+        if deadline is not None:
+            remaining = max(0.0, deadline - time.monotonic())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        return timeout
+
+    def _wait_debounced(self, max_events, timeout):
+        debouncer = self._debouncer
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            events = debouncer.take(max_events)
+
+            if events:
+                return events
+
+            if self._poll(self._debounce_timeout(deadline)):
+                debouncer.feed(self._read_events(16))
+            elif deadline is not None and time.monotonic() >= deadline:
+                return debouncer.take(max_events)
+
+    async def _wait_debounced_async(self, ready, max_events, timeout):
+        debouncer = self._debouncer
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            events = debouncer.take(max_events)
+
+            if events:
+                return events
+
+            try:
+                await _readable(
+                    ready, self._file.fileno(), self._debounce_timeout(deadline)
+                )
+            except _asyncio().TimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return debouncer.take(max_events)
+            else:
+                debouncer.feed(self._read_events(16))
+
+    def _update_clocks(self):
+        realtime, hte = self._event_clocks
+
+        for offset, bit in self._bit_offsets.items():
+            self._profiler.realtime.discard(offset)
+            self._profiler.hte.discard(offset)
+
+            if realtime >> bit & 1:
+                self._profiler.realtime.add(offset)
+            elif hte >> bit & 1:
+                self._profiler.hte.add(offset)
+
+    def _poll(self, timeout):
+        if not self._epoll:
+            self._epoll = select.epoll()
+            fd = self._file.fileno()
+            self._epoll.register(fd, select.EPOLLIN)
+
+        fds = self._epoll.poll(timeout=timeout)
+
+        if not fds:
+            return False
+
+        assert not fds[0][1] & select.EPOLLERR, "EPOLLERR"
+        return True
+
+    def get_bits_unchecked(self, mask: int) -> int:
+        """
+        Get GPIO line states as a bitmask without checking for overflow.
+        """
+        self._values.bits = 0
+        self._values.mask = mask
+        self._ioctl(GPIO_V2_LINE_GET_VALUES_IOCTL, self._values)
+        return self._values.bits
+
+    def set_bits_unchecked(self, bits: int, mask: int):
+        """
+        Set GPIO line states from a bitmask without checking for overflow.
+        """
+        if self._batch:
+            self._pending_bits = self._pending_bits & ~mask | bits & mask
+            self._pending_mask |= mask
+        else:
+            self._values.bits = bits
+            self._values.mask = mask
+            self._ioctl(GPIO_V2_LINE_SET_VALUES_IOCTL, self._values)
+
+        if self._shadow is not None:
+            self._shadow = self._shadow & ~mask | bits & mask
+
+    def get_bits(self, mask: int) -> int:
+        """
+        Lower-level function to directly get GPIO line states as a bitmask.
+        """
+        assert 0 <= mask <= U64_MAX, "mask out of range"
+        return self.get_bits_unchecked(mask)
+
+    def set_bits(self, bits: int, mask: int):
+        """
+        Lower-level function to directly set GPIO line states from a bitmask.
+        """
+        assert 0 <= bits <= U64_MAX, "bits out of range"
+        assert 0 <= mask <= U64_MAX, "mask out of range"
+        self.set_bits_unchecked(bits, mask)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Merge all writes within this context into a single ioctl at exit.
+        Later writes win for each line. Batches may be nested. If the outermost
+        batch exits with an exception, the merged writes are discarded.
+        """
+        self._batch += 1
+
+        try:
+            yield
+        except BaseException:
+            if self._batch == 1:
+                self._pending_bits = 0
+                self._pending_mask = 0
+
+            raise
+        finally:
+            self._batch -= 1
+
+            if not self._batch:
+                self.flush()
+
+    def flush(self):
+        """
+        Write out the values merged so far in a batch.
+        """
+        if self._pending_mask:
+            self._values.bits = self._pending_bits
+            self._values.mask = self._pending_mask
+            self._pending_bits = 0
+            self._pending_mask = 0
+            self._ioctl(GPIO_V2_LINE_SET_VALUES_IOCTL, self._values)
+
+    def get_outputs(self) -> int:
+        """
+        Get the last written GPIO line states as a bitmask from the shadow copy.
+        """
+        assert self._shadow is not None, "shadow not enabled"
+        return self._shadow
+
+    def toggle(self, mask: int):
+        """
+        Invert GPIO line states selected by mask, using the shadow copy.
+        """
+        assert self._shadow is not None, "shadow not enabled"
+        assert 0 <= mask <= U64_MAX, "mask out of range"
+        self.set_bits_unchecked(~self._shadow & mask, mask)
+
+    def update(self, bits: int, mask: int):
+        """
+        Set GPIO line states from a bitmask, writing only lines that differ
+        from the shadow copy. No ioctl is issued if nothing changes.
+        """
+        assert self._shadow is not None, "shadow not enabled"
+        assert 0 <= bits <= U64_MAX, "bits out of range"
+        assert 0 <= mask <= U64_MAX, "mask out of range"
+        changed = (self._shadow ^ bits) & mask
+
+        if changed:
+            self.set_bits_unchecked(bits, changed)
+
+    def get(self) -> Dict[int, bool]:
+        """
+        Convenience function to get GPIO line states as a dict of offsets and values.
+        """
+        bits = self.get_bits(U64_MAX)
+        return dict((k, bool(bits & 1 << v)) for (k, v) in self._bit_offsets.items())
+
+    def set(self, values: Dict[int, bool]):
+        """
+        Convenience function to set GPIO line states from a dict of offsets and values.
+        """
+        bits = 0
+        mask = 0
+
+        for k, v in values.items():
+            offset = int(k)
+            assert offset in self._bit_offsets, f"offset {offset} not configured"
+            shift = self._bit_offsets[offset]
+            bits |= bool(v) << shift
+            mask |= 1 << shift
+
+        self.set_bits(bits, mask)
+
+    def compile(self, offsets: Sequence[int]) -> "LineMap":
+        """
+        Precompute an accessor for getting and setting a fixed subset of these lines.
+        """
+        return LineMap(self, self._subset(offsets))
+
+    def _subset(self, offsets):
+        keys = [int(k) for k in offsets]
+
+        for offset in keys:
+            assert offset in self._bit_offsets, f"offset {offset} not configured"
+            assert keys.count(offset) == 1, f"duplicate offset: {offset}"
+
+        return keys
+
+    def fast(self) -> "FastLines":
+        """
+        Get an accessor for GPIO line states as bitmasks with minimal per-call overhead.
+        """
+        return FastLines(self)
+
+    def port(self, offsets: Sequence[int]) -> "Port":
+        """
+        Treat a subset of these lines as an integer, with the first offset as the
+        least significant bit.
+        """
+        return Port(self, self._subset(offsets))
+
+    def play(
+        self,
+        sequence: Sequence[Tuple[int, int]],
+        period_ns: int,
+        cpu: Optional[int] = None,
+    ) -> "Player":
+        """
+        Start playing back a sequence of (bits, mask) steps, one step per period.
+        The player thread can optionally be pinned to a CPU.
+        """
+        player = Player(self, sequence, period_ns, cpu=cpu)
+        player.start()
+        return player
+
+    def set_config(
+        self, flags: Optional[List[str]] = None, attrs: Optional[List[Dict]] = None
+    ):
+        """
+        Reconfigure this set of GPIO lines.
+        """
+        attrs = list(Chip._build_attrs(attrs or []))
+        num_attrs = len(attrs)
+        config = gpio_v2_line_config(
+            flags=Chip._build_flags(flags), num_attrs=num_attrs
+        )
+        config.attrs[:num_attrs] = attrs
+        self._ioctl(GPIO_V2_LINE_SET_CONFIG_IOCTL, config)
+        self._event_clocks = Chip._event_clocks(config.flags, attrs)
+        self._outputs = Chip._outputs(config.flags, attrs, self._outputs)
+
+        if self._shadow is not None:
+            self._shadow = Chip._output_values(self._shadow, attrs)
+
+        if self._profiler is not None:
+            self._update_clocks()
+
+    def _read_event(self):
+        event = gpio_v2_line_event()
+        ret = self._file.readinto(event)
+        assert ret == sizeof(gpio_v2_line_event)
+
+        if self._metrics is not None:
+            self._count((event,))
+
+        if self._profiler is not None:
+            self._profiler.record((event,))
+
+        return self._event(event)
+
+    def _read_events(self, max_events):
+        if len(self._events) < max_events:
+            self._events = (gpio_v2_line_event * max_events)()
+
+        size = sizeof(gpio_v2_line_event)
+        buf = memoryview(self._events).cast("B")[: max_events * size]
+        ret = self._file.readinto(buf)
+        assert ret and ret % size == 0
+        events = (gpio_v2_line_event * (ret // size)).from_buffer(self._events)
+
+        if self._metrics is not None:
+            self._count(events)
+
+        if self._profiler is not None:
+            self._profiler.record(events)
+
+        return events
+
+    def _count(self, events):
+        n = len(events)
+        first_seqno = self._seqno + 1 if self._seqno else events[0].seqno
+        self._seqno = events[n - 1].seqno
+        self._metrics._count(n, (self._seqno - first_seqno - n + 1) & U32_MAX)
+
+    @staticmethod
+    def _event(event):
+        return LineEvent(
+            event.timestamp_ns, event.id, event.offset, event.seqno, event.line_seqno
+        )
+
+    def wait(self, timeout: Optional[float] = None) -> Optional["LineEvent"]:
+        """
+        Wait for the next edge event on this set of GPIO lines.
+        """
+        if self._debouncer is not None:
+            events = self._wait_debounced(1, timeout)
+            return events[0] if events else None
+
+        if not self._poll(timeout):
+            return None
+
+        if self._metrics is not None:
+            return self._metrics._call("wait", self._read_event)
+
+        return self._read_event()
+
+    def read_events(
+        self, max_events: int = 16, timeout: Optional[float] = None
+    ) -> Optional["Array[gpio_v2_line_event]"]:
+        """
+        Wait for edge events and read up to max_events queued events at once.
+        The returned array is a view into a buffer that is reused by the next call.
+        """
+        assert 0 < max_events <= U32_MAX, "max_events out of range"
+
+        if self._debouncer is not None:
+            events = self._wait_debounced(max_events, timeout)
+            return _raw_events(events) if events else None
+
+        if not self._poll(timeout):
+            return None
+
+        if self._metrics is not None:
+            return self._metrics._call("read_events", self._read_events, max_events)
+
+        return self._read_events(max_events)
+
+    async def wait_async(
+        self, timeout: Optional[float] = None
+    ) -> Optional["LineEvent"]:
+        """
+        Wait for the next edge event on this set of GPIO lines in an asyncio event loop.
+        """
+        with _reader(self._file.fileno()) as ready:
+            if self._debouncer is not None:
+                events = await self._wait_debounced_async(ready, 1, timeout)
+                return events[0] if events else None
+
+            try:
+                await _readable(ready, self._file.fileno(), timeout)
+            except _asyncio().TimeoutError:
+                return None
+
+        return self._read_event()
+
+    async def events(self, max_events: int = 16) -> AsyncIterator["LineEvent"]:
+        """
+        Iterate over edge events on this set of GPIO lines in an asyncio event loop.
+        """
+        assert 0 < max_events <= U32_MAX, "max_events out of range"
+
+        with _reader(self._file.fileno()) as ready:
+            while True:
+                if self._debouncer is not None:
+                    for event in await self._wait_debounced_async(
+                        ready, max_events, None
+                    ):
+                        yield event
+
+                    continue
+
+                await _readable(ready, self._file.fileno())
+
+                for event in self._read_events(max_events):
+                    yield self._event(event)
+
+    def _dispatch(self, callback, readable=True):
+        if self._debouncer is not None:
+            if readable:
+                self._debouncer.feed(self._read_events(16))
+
+            for event in self._debouncer.take(U32_MAX):
+                callback(event)
+
+            return
+
+        for event in self._read_events(16):
+            callback(self._event(event))
+
+
+class LineMap:
+    """
+    Precompiled accessor for a fixed subset of a set of GPIO lines.
+    Values are given in the order of the offsets passed to Lines.compile().
+    """
+
+    TABLE_MAX_LINES = 8
+
+    def __init__(self, lines: Lines, offsets: List[int]):
+        """
+        Constructor is subject to change; use Lines.compile().
+        """
+        self._lines = lines
+        self._offsets = tuple(offsets)
+        self._bits = tuple(1 << lines._bit_offsets[k] for k in offsets)
+        self._mask = sum(self._bits)
+        self._table: Optional[List[int]] = None
+        self._rtable: Optional[Dict[int, int]] = None
+
+        if len(offsets) <= self.TABLE_MAX_LINES:
+            self._table = [self._pack(v) for v in range(1 << len(offsets))]
+            self._rtable = dict((v, i) for (i, v) in enumerate(self._table))
+
+    def _pack(self, value):
+        bits = 0
+
+        for i, bit in enumerate(self._bits):
+            if value >> i & 1:
+                bits |= bit
+
+        return bits
+
+    def _unpack(self, bits):
+        value = 0
+
+        for i, bit in enumerate(self._bits):
+            if bits & bit:
+                value |= 1 << i
+
+        return value
+
+    def get(self) -> Dict[int, bool]:
+        """
+        Get the line states as a dict of offsets and values.
+        """
+        bits = self._lines.get_bits_unchecked(self._mask)
+        return dict((k, bool(bits & b)) for (k, b) in zip(self._offsets, self._bits))
+
+    def set(self, values: Sequence[bool]):
+        """
+        Set the line states from a sequence of values.
+        """
+        assert len(values) == len(self._bits), "wrong number of values"
+        bits = 0
+
+        for v, b in zip(values, self._bits):
+            if v:
+                bits |= b
+
+        self._lines.set_bits_unchecked(bits, self._mask)
+
+    def read(self) -> int:
+        """
+        Get the line states as an integer, with the first line as the least significant bit.
+        """
+        bits = self._lines.get_bits_unchecked(self._mask)
+
+        if self._rtable is not None:
+            return self._rtable[bits]
+
+        return self._unpack(bits)
+
+    def write(self, value: int):
+        """
+        Set the line states from an integer, with the first line as the least significant bit.
+        """
+        assert 0 <= value < 1 << len(self._bits), "value out of range"
+
+        if self._table is not None:
+            self._lines.set_bits_unchecked(self._table[value], self._mask)
+        else:
+            self._lines.set_bits_unchecked(self._pack(value), self._mask)
+
+
+class Port(LineMap):
+    """
+    A subset of a set of GPIO lines treated as an integer, e.g. a parallel bus.
+    Bits are mapped to lines with precomputed byte-wise lookup tables.
+    """
+
+    # The byte-wise tables replace the whole-value tables of LineMap.
+    TABLE_MAX_LINES = -1
+
+    def __init__(self, lines: Lines, offsets: Sequence[int]):
+        """
+        Constructor is subject to change; use Lines.port().
+        """
+        super().__init__(lines, list(offsets))
+        nbytes = (len(offsets) + 7) // 8
+        self._wtables = [
+            [self._pack(v << i * 8) for v in range(256)] for i in range(nbytes)
+        ]
+        self._rtables = [
+            (i * 8, [self._unpack(v << i * 8) for v in range(256)])
+            for i in range(8)
+            if self._mask >> i * 8 & 0xFF
+        ]
+
+    def read(self) -> int:
+        """
+        Get the port value.
+        """
+        bits = self._lines.get_bits_unchecked(self._mask)
+        value = 0
+
+        for shift, table in self._rtables:
+            value |= table[bits >> shift & 0xFF]
+
+        return value
+
+    def _encode(self, value):
+        bits = 0
+
+        for i, table in enumerate(self._wtables):
+            bits |= table[value >> i * 8 & 0xFF]
+
+        return bits
+
+    def write(self, value: int):
+        """
+        Set the port value.
+        """
+        assert 0 <= value < 1 << len(self._bits), "value out of range"
+        self._lines.set_bits_unchecked(self._encode(value), self._mask)
+
+    def write_many(self, values: Iterable[int]):
+        """
+        Set the port to each of the given values in turn, e.g. from bytes or an array.
+        All values are encoded before the first one is written, without range checks.
+        """
+        if len(self._wtables) == 1:
+            table = self._wtables[0]
+            frames = [table[v] for v in values]
+        else:
+            frames = [self._encode(v) for v in values]
+
+        set_bits = self._lines.set_bits_unchecked
+        mask = self._mask
+
+        for bits in frames:
+            set_bits(bits, mask)
+
+
+class FastLines:
+    """
+    Minimal-overhead access to GPIO line states as bitmasks. The file descriptor
+    and a preallocated gpio_v2_line_values buffer are bound once, and nothing is
+    checked per call. Batches and the shadow copy of Lines are bypassed.
+    """
+
+    def __init__(self, lines: Lines):
+        """
+        Constructor is subject to change; use Lines.fast().
+        """
+        values = memoryview(bytearray(sizeof(gpio_v2_line_values))).cast("Q")
+
+        def get_bits(
+            mask,
+            values=values,
+            _ioctl=lines._ioctl,
+            request=GPIO_V2_LINE_GET_VALUES_IOCTL,
+        ):
+            values[0] = 0
+            values[1] = mask
+            _ioctl(request, values)
+            return values[0]
+
+        def set_bits(
+            bits,
+            mask,
+            values=values,
+            _ioctl=lines._ioctl,
+            request=GPIO_V2_LINE_SET_VALUES_IOCTL,
+        ):
+            values[0] = bits
+            values[1] = mask
+            _ioctl(request, values)
+
+        self.get_bits: Callable[[int], int] = get_bits
+        self.set_bits: Callable[[int, int], None] = set_bits
+
+
+class _InfoCache:
+    """
+    Line info for every line of a chip, kept current from line_info_changed events
+    on a descriptor of its own, so that the watches of the chip's user are unaffected.
+    """
+
+    def __init__(self, path, backend):
+        fd = backend.open(path)
+        self._file = FileIO(fd)
+        self._release = weakref.finalize(self, backend.release, fd)
+        self._epoll = select.epoll()
+        self._epoll.register(fd, select.EPOLLIN)
+        self._ioctl = partial(backend.ioctl, fd)
+        self.infos = {}
+
+    def watch(self, lines):
+        """
+        Watch the given number of lines, starting from their current info.
+        """
+        for i in range(lines):
+            line_info = gpio_v2_line_info(offset=i)
+            self._ioctl(GPIO_V2_GET_LINEINFO_WATCH_IOCTL, line_info)
+            self.infos[i] = line_info
+
+    def drain(self):
+        """
+        Apply all pending line_info_changed events without blocking.
+        Returns the offsets that changed.
+        """
+        offsets = []
+
+        while self._epoll.poll(0):
+            event = gpio_v2_line_info_changed()
+            ret = self._file.readinto(event)
+            assert ret == sizeof(gpio_v2_line_info_changed)
+            self.infos[event.info.offset] = event.info
+            offsets.append(event.info.offset)
+
+        return offsets
+
+    def close(self):
+        """
+        Stop watching and close the descriptor.
+        """
+        self._epoll.close()
+        self._release()
+        self._file.close()
+
+
+# Holds the optional line info cache and name index next to the descriptor.
+class Chip:  # pylint: disable=too-many-instance-attributes
+    """
+    Abstraction over one logical device that manages multiple GPIO lines.
+    """
+
+    _flags = dict(
+        (k, v) for (k, v) in globals().items() if k.startswith("GPIO_V2_LINE_FLAG_")
+    )
+
+    def __init__(self, path, backend=None):
+        """
+        Constructor is subject to change; do not use.
+        """
+        backend = backend or _kernel
+        fd = backend.open(path)
+        self._path = path
+        self._epoll = None
+        self._file = FileIO(fd)
+        self._ioctl = partial(backend.ioctl, fd)
+        self._backend = backend
+        self._release = weakref.finalize(self, backend.release, fd)
+        self._chip_info = None
+        self._cache = None
+        self._decoded = {}
+        self._names = None
+        self._metrics = None
+
+    def fileno(self) -> int:
+        """
+        Get the file descriptor of this GPIO chip, e.g. for use with select.
+        """
+        return self._file.fileno()
+
+    def close(self):
+        """
+        Close this GPIO chip. Lines requested from it stay configured.
+        """
+        if self._epoll:
+            self._epoll.close()
+
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+        self._release()
+        self._file.close()
+
+    def instrument(self, metrics: Optional[Metrics] = None) -> Metrics:
+        """
+        Record ioctls, waits and events into metrics, or into a new Metrics.
+        Lines requested afterwards record into the same Metrics.
+        """
+        if metrics is None:
+            metrics = Metrics()
+
+        self._ioctl = metrics._wrap(partial(self._backend.ioctl, self._file.fileno()))
+        self._metrics = metrics
+        return metrics
+
+    def uninstrument(self):
+        """
+        Stop recording into the Metrics given to instrument().
+        """
+        self._ioctl = partial(self._backend.ioctl, self._file.fileno())
+        self._metrics = None
+
+    def _get_chip_info(self):
+        chip_info = gpiochip_info()
+        self._ioctl(GPIO_GET_CHIPINFO_IOCTL, chip_info)
+        return chip_info
+
+    def _get_line_info(self, offset):
+        line_info = gpio_v2_line_info(offset=offset)
+        self._ioctl(GPIO_V2_GET_LINEINFO_IOCTL, line_info)
+        return line_info
+
+    def _get_line(self, offsets, consumer, flags, attrs, event_buffer_size=0):
+        num_lines = len(offsets)
+        num_attrs = len(attrs)
+        config = gpio_v2_line_config(flags=flags, num_attrs=num_attrs)
+        config.attrs[:num_attrs] = attrs
+
+        request = gpio_v2_line_request(
+            config=config,
+            num_lines=num_lines,
+            event_buffer_size=event_buffer_size,
+        )
+
+        if consumer:
+            request.consumer = consumer.encode()
+
+        request.offsets[:num_lines] = offsets
+        self._ioctl(GPIO_V2_GET_LINE_IOCTL, request)
+        return request.fd
+
+    @classmethod
+    def _iter_flags(cls, flags):
+        for name, value in cls._flags.items():
+            if flags & value:
+                yield name.replace("GPIO_V2_LINE_FLAG_", "")
+
+    @classmethod
+    def _build_flags(cls, flags):
+        ret = 0
+
+        if flags:
+            for name in flags:
+                value = cls._flags.get("GPIO_V2_LINE_FLAG_" + name, 0)
+                ret |= value
+
+        return ret
+
+    @staticmethod
+    def _iter_attrs(num_attrs, attrs):
+        for i in range(num_attrs):
+            attr = attrs[i]
+
+            if attr.id == GPIO_V2_LINE_ATTR_ID_FLAGS:
+                yield {"flags": attr.u.flags}
+            elif attr.id == GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES:
+                yield {"values": attr.u.values}
+            elif attr.id == GPIO_V2_LINE_ATTR_ID_DEBOUNCE:
+                yield {"debounce_period_us": attr.u.debounce_period_us}
+            else:
+                pass
+
+    @classmethod
+    def _build_attrs(cls, attrs):
+        assert len(attrs) <= GPIO_V2_LINE_NUM_ATTRS_MAX, "too many attributes"
+
+        for a in attrs:
+            mask = a["mask"]
+            assert 0 <= mask <= U64_MAX, "mask out of range"
+
+            if "flags" in a:
+                flags = cls._build_flags(a["flags"])
+                attr = gpio_v2_line_attribute()
+                attr.id = GPIO_V2_LINE_ATTR_ID_FLAGS
+                attr.u.flags = flags
+                yield gpio_v2_line_config_attribute(mask=mask, attr=attr)
+            elif "values" in a:
+                values = a["values"]
+                assert 0 <= values <= U64_MAX, "values out of range"
+                attr = gpio_v2_line_attribute()
+                attr.id = GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES
+                attr.u.values = values
+                yield gpio_v2_line_config_attribute(mask=mask, attr=attr)
+            elif "debounce_period_us" in a:
+                attr = gpio_v2_line_attribute()
+                attr.id = GPIO_V2_LINE_ATTR_ID_DEBOUNCE
+                attr.u.debounce_period_us = a["debounce_period_us"]
+                yield gpio_v2_line_config_attribute(mask=mask, attr=attr)
+            else:
+                continue
+
+    @staticmethod
+    def _output_values(values, attrs):
+        for a in attrs:
+            if a.attr.id == GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES:
+                values = values & ~a.mask | a.attr.u.values & a.mask
+
+        return values
+
+    @staticmethod
+    def _event_clocks(flags, attrs):
+        realtime = U64_MAX if flags & GPIO_V2_LINE_FLAG_EVENT_CLOCK_REALTIME else 0
+        hte = U64_MAX if flags & GPIO_V2_LINE_FLAG_EVENT_CLOCK_HTE else 0
+
+        for a in attrs:
+            if a.attr.id == GPIO_V2_LINE_ATTR_ID_FLAGS:
+                line_flags = a.attr.u.flags
+                realtime &= ~a.mask
+                hte &= ~a.mask
+
+                if line_flags & GPIO_V2_LINE_FLAG_EVENT_CLOCK_REALTIME:
+                    realtime |= a.mask
+                elif line_flags & GPIO_V2_LINE_FLAG_EVENT_CLOCK_HTE:
+                    hte |= a.mask
+
+        return (realtime, hte)
+
+    @staticmethod
+    def _outputs(flags, attrs, outputs=0):
+        # Lines configured without a direction keep the one they had.
+        def direction(line_flags):
+            if line_flags & GPIO_V2_LINE_FLAG_OUTPUT:
+                return U64_MAX
+            if line_flags & GPIO_V2_LINE_FLAG_INPUT:
+                return 0
+            return outputs
+
+        ret = direction(flags)
+
+        for a in attrs:
+            if a.attr.id == GPIO_V2_LINE_ATTR_ID_FLAGS:
+                ret = ret & ~a.mask | direction(a.attr.u.flags) & a.mask
+
+        return ret
+
+    @classmethod
+    def _line_info(cls, li):
+        return {
+            "name": li.name.decode(errors="replace"),
+            "consumer": li.consumer.decode(errors="replace"),
+            "offset": li.offset,
+            "flags": list(cls._iter_flags(li.flags)),
+            "attrs": list(cls._iter_attrs(li.num_attrs, li.attrs)),
+        }
+
+    @classmethod
+    def _line_field(cls, li, field):
+        if field == "name":
+            return li.name.decode(errors="replace")
+        if field == "consumer":
+            return li.consumer.decode(errors="replace")
+        if field == "offset":
+            return li.offset
+        if field == "flags":
+            return list(cls._iter_flags(li.flags))
+        if field == "attrs":
+            return list(cls._iter_attrs(li.num_attrs, li.attrs))
+
+        raise KeyError(field)
+
+    def _refresh_cache(self):
+        assert self._cache is not None
+
+        for offset in self._cache.drain():
+            self._decoded.pop(offset, None)
+            self._names = None
+
+    def _cached_line_info(self, offset, fields):
+        assert self._cache is not None
+        data = self._decoded.get(offset)
+
+        if data is None:
+            data = self._line_info(self._cache.infos[offset])
+            self._decoded[offset] = data
+
+        if fields is None:
+            return dict(data)
+
+        return dict((k, data[k]) for k in fields)
+
+    def info(
+        self,
+        offsets: Optional[List[int]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Dict:
+        """
+        Get all available info on this chip and the lines it manages.
+        Optionally, only the given line offsets and line info fields are included.
+        """
+        chip_info = self._chip_info or self._get_chip_info()
+
+        if offsets is None:
+            offsets = list(range(chip_info.lines))
+
+        for i in offsets:
+            assert 0 <= i < chip_info.lines, f"offset out of range: {i}"
+
+        if self._cache is not None:
+            self._refresh_cache()
+            lines = [self._cached_line_info(i, fields) for i in offsets]
+        elif fields is None:
+            lines = [self._line_info(self._get_line_info(i)) for i in offsets]
+        else:
+            lines = []
+
+            for i in offsets:
+                li = self._get_line_info(i)
+                lines.append(dict((k, self._line_field(li, k)) for k in fields))
+
+        data = {
+            "name": chip_info.name.decode(errors="replace"),
+            "label": chip_info.name.decode(errors="replace"),
+            "lines": lines,
+        }
+
+        return data
+
+    def cache(self):
+        """
+        Watch all lines on this chip and serve info() from memory from now on.
+        The cache watches on a descriptor of its own and applies pending changes
+        on each info() call, so watch(), unwatch(), wait() and events() are unaffected.
+        """
+        chip_info = self._get_chip_info()
+        cache = _InfoCache(self._path, self._backend)
+
+        try:
+            cache.watch(chip_info.lines)
+        except OSError:
+            cache.close()
+            raise
+
+        if self._cache is not None:
+            self._cache.close()
+
+        self._chip_info = chip_info
+        self._cache = cache
+        self._decoded.clear()
+        self._names = None
+
+    def refresh(self) -> List["LineInfoChanged"]:
+        """
+        Read all pending line_info_changed events without blocking and return them.
+        """
+        events = []
+
+        while self._poll(0):
+            events.append(self._read_event())
+
+        return events
+
+    def request(
+        self,
+        offsets: List[int],
+        consumer: Optional[str] = None,
+        flags: Optional[List[str]] = None,
+        attrs: Optional[List[Dict]] = None,
+        *,
+        event_buffer_size: int = 0,
+        shadow: bool = False,
+    ) -> Lines:
+        """
+        Configure a set of GPIO lines with the given settings.
+        With shadow, the last written output values are tracked for toggle() and update().
+        """
+        assert len(offsets) <= GPIO_V2_LINES_MAX, "too many lines"
+        assert 0 <= event_buffer_size <= U32_MAX, "event_buffer_size out of range"
+
+        for i in offsets:
+            assert 0 <= i <= U32_MAX, f"offset out of range: {i}"
+            assert offsets.count(i) == 1, f"duplicate offset: {i}"
+
+        built_flags = self._build_flags(flags)
+        built_attrs = list(self._build_attrs(attrs or []))
+
+        fd = self._get_line(
+            offsets,
+            consumer=consumer,
+            flags=built_flags,
+            attrs=built_attrs,
+            event_buffer_size=event_buffer_size,
+        )
+
+        lines = Lines(
+            fd,
+            offsets,
+            shadow=self._output_values(0, built_attrs) if shadow else None,
+            backend=self._backend,
+            event_clocks=self._event_clocks(built_flags, built_attrs),
+            outputs=self._outputs(built_flags, built_attrs),
+        )
+
+        if self._metrics is not None:
+            lines.instrument(self._metrics)
+
+        for period_us, debounced in self._software_debounce(offsets, built_attrs):
+            lines.debounce(period_us, debounced)
+
+        return lines
+
+    def _software_debounce(self, offsets, attrs):
+        periods = {}
+
+        for i, offset in enumerate(offsets):
+            period_us = next(
+                (
+                    a.attr.u.debounce_period_us
+                    for a in attrs
+                    if a.attr.id == GPIO_V2_LINE_ATTR_ID_DEBOUNCE and a.mask >> i & 1
+                ),
+                0,
+            )
+
+            if not period_us:
+                continue
+
+            li = self._get_line_info(offset)
+
+            if not any(
+                li.attrs[j].id == GPIO_V2_LINE_ATTR_ID_DEBOUNCE
+                for j in range(li.num_attrs)
+            ):
+                periods.setdefault(period_us, []).append(offset)
+
+        return periods.items()
+
+    def _line_names(self):
+        if self._cache is not None:
+            infos = self._cache.infos.values()
+        else:
+            infos = (self._get_line_info(i) for i in range(self._get_chip_info().lines))
+
+        names = {}
+
+        for li in infos:
+            name = li.name.decode(errors="replace")
+
+            if name and name not in names:
+                names[name] = li.offset
+
+        return names
+
+    def find_line(self, name: str) -> Optional[int]:
+        """
+        Get the offset of the first line on this chip with the given name.
+        Line names are indexed on first use.
+        """
+        if self._cache is not None:
+            self._refresh_cache()
+
+        if self._names is None:
+            self._names = self._line_names()
+
+        return self._names.get(name)
+
+    def request_by_name(self, names: List[str], **kwargs) -> Lines:
+        """
+        Configure a set of GPIO lines given by name. Other arguments are as for request().
+        """
+        offsets = []
+
+        for name in names:
+            offset = self.find_line(name)
+            assert offset is not None, f"line not found: {name}"
+            offsets.append(offset)
+
+        return self.request(offsets, **kwargs)
+
+    def watch(self, offset: int):
+        """
+        Start watching for line_info_changed events on this GPIO chip.
+        """
+        assert 0 <= offset <= U32_MAX
+        line_info = gpio_v2_line_info(offset=offset)
+        self._ioctl(GPIO_V2_GET_LINEINFO_WATCH_IOCTL, line_info)
+
+    def unwatch(self, offset: int):
+        """
+        Stop watching for line_info_changed events on this GPIO chip.
+        """
+        assert 0 <= offset <= U32_MAX
+        c_offset = c_uint32(offset)
+        self._ioctl(GPIO_GET_LINEINFO_UNWATCH_IOCTL, c_offset)
+
+    def _poll(self, timeout):
+        if not self._epoll:
+            self._epoll = select.epoll()
+            fd = self._file.fileno()
+            self._epoll.register(fd, select.EPOLLIN)
+
+        fds = self._epoll.poll(timeout=timeout)
+
+        if not fds:
+            return False
+
+        assert not fds[0][1] & select.EPOLLERR, "EPOLLERR"
+        return True
+
+    def _read_event(self):
+        event = gpio_v2_line_info_changed()
+        ret = self._file.readinto(event)
+        assert ret == sizeof(gpio_v2_line_info_changed)
+
+        if self._names is not None:
+            name = event.info.name.decode(errors="replace")
+
+            if self._names.get(name) != event.info.offset:
+                self._names = None
+
+        if self._metrics is not None:
+            self._metrics._count(1, 0)
+
+        return LineInfoChanged(event)
+
+    def wait(self, timeout: Optional[float] = None) -> Optional["LineInfoChanged"]:
+        """
+        Wait for the next line_info_changed event on this GPIO chip.
+        """
+        if not self._poll(timeout):
+            return None
+
+        if self._metrics is not None:
+            return self._metrics._call("wait", self._read_event)
+
+        return self._read_event()
+
+    async def wait_async(
+        self, timeout: Optional[float] = None
+    ) -> Optional["LineInfoChanged"]:
+        """
+        Wait for the next line_info_changed event on this GPIO chip in an asyncio event loop.
+        """
+        with _reader(self._file.fileno()) as ready:
+            try:
+                await _readable(ready, self._file.fileno(), timeout)
+            except _asyncio().TimeoutError:
+                return None
+
+        return self._read_event()
+
+    async def events(self) -> AsyncIterator["LineInfoChanged"]:
+        """
+        Iterate over line_info_changed events on this GPIO chip in an asyncio event loop.
+        """
+        with _reader(self._file.fileno()) as ready:
+            while True:
+                await _readable(ready, self._file.fileno())
+                yield self._read_event()
+
+    def _dispatch(self, callback):
+        callback(self._read_event())
+
+
+class _Handle:
+    def __init__(self, fd):
+        self._fd = fd
+
+    def fileno(self):
+        """
+        Get the file descriptor to watch.
+        """
+        return self._fd
+
+    def _dispatch(self, callback):
+        callback(self._fd)
+
+
+_Waitable = typing.Union[Lines, Chip, _Handle]
+
+
+class Selector:
+    """
+    Wait for events on any number of Lines and Chip objects with a single epoll.
+    """
+
+    def __init__(self):
+        self._epoll = select.epoll()
+        self._handlers = {}
+
+    def register(self, obj: _Waitable, callback: Optional[Callable] = None):
+        """
+        Start watching a Lines or Chip object, optionally with an event callback.
+        """
+        fd = obj.fileno()
+        assert fd not in self._handlers, "already registered"
+        self._epoll.register(fd, select.EPOLLIN)
+        self._handlers[fd] = (obj, callback)
+
+    def unregister(self, obj: _Waitable):
+        """
+        Stop watching a Lines or Chip object.
+        """
+        fd = obj.fileno()
+        self._epoll.unregister(fd)
+        del self._handlers[fd]
+
+    def select(self, timeout: Optional[float] = None) -> List[_Waitable]:
+        """
+        Wait until at least one registered object has events pending and return those.
+        """
+        ready = []
+
+        for fd, mask in self._epoll.poll(timeout=timeout):
+            assert not mask & select.EPOLLERR, "EPOLLERR"
+            ready.append(self._handlers[fd][0])
+
+        return ready
+
+    def dispatch(self, timeout: Optional[float] = None) -> int:
+        """
+        Wait for events and pass each one to the callback of its object.
+        Edges held back by software debounce are passed on once they are due.
+        Returns the number of objects that had events pending.
+        """
+        debounced = [
+            fd
+            for (fd, (obj, _)) in self._handlers.items()
+            if isinstance(obj, Lines) and obj._debouncer is not None
+        ]
+
+        for fd in debounced:
+            due = self._handlers[fd][0]._debouncer.timeout()
+
+            if due is not None and (timeout is None or due < timeout):
+                timeout = due
+
+        ready = self._epoll.poll(timeout=timeout)
+        polled = [fd for (fd, _) in ready]
+
+        for fd in debounced:
+            if fd not in polled and self._handlers[fd][0]._debouncer.timeout() == 0:
+                ready.append((fd, 0))
+
+        for fd, mask in ready:
+            handler = self._handlers.get(fd)
+
+            # Unregistered by a callback earlier in this round.
+            if handler is None:
+                continue
+
+            obj, callback = handler
+            assert callback, "no callback registered"
+            # Errors on raw descriptors, e.g. a reset socket, are for the callback to handle.
+            assert isinstance(obj, _Handle) or not mask & select.EPOLLERR, "EPOLLERR"
+
+            if mask:
+                obj._dispatch(callback)
+            else:
+                # Only edges held back by debounce are due; the fd is not readable.
+                obj._dispatch(callback, readable=False)
+
+        return len(ready)
+
+    def close(self):
+        """
+        Release the epoll instance of this selector.
+        """
+        self._epoll.close()
+        self._handlers.clear()
+
+
+# Ring buffer, staging buffer and counters are shared with the reader thread.
+class Capture:  # pylint: disable=too-many-instance-attributes
+    """
+    Drain edge events of a set of GPIO lines into a ring buffer from a background thread.
+    """
+
+    def __init__(self, lines: Lines, capacity: int = 1024, batch: int = 64):
+        assert 0 < capacity <= U32_MAX, "capacity out of range"
+        assert 0 < batch <= U32_MAX, "batch out of range"
+        self._lines = lines
+        self._ring = (gpio_v2_line_event * capacity)()
+        self._staging = (gpio_v2_line_event * batch)()
+        self._out = (gpio_v2_line_event * 0)()
+        self._head = 0
+        self._count = 0
+        self._seqno = 0
+        self._dropped = 0
+        self._overruns = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._wake = (-1, -1)
+
+    @property
+    def dropped(self) -> int:
+        """
+        Number of events lost in the kernel, as detected from gaps in seqno.
+        """
+        return self._dropped
+
+    @property
+    def overruns(self) -> int:
+        """
+        Number of events discarded because the ring buffer was full.
+        """
+        return self._overruns
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        Start the reader thread.
+        """
+        assert not self._thread, "already started"
+        assert self._lines._debouncer is None, "software debounce not supported"
+        self._wake = os.pipe()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the reader thread. Events already captured can still be read.
+        """
+        assert self._thread, "not started"
+        os.write(self._wake[1], b"\0")
+        self._thread.join()
+        self._thread = None
+
+        for fd in self._wake:
+            os.close(fd)
+
+    def _run(self):
+        epoll = select.epoll()
+        epoll.register(self._lines.fileno(), select.EPOLLIN)
+        epoll.register(self._wake[0], select.EPOLLIN)
+        size = sizeof(gpio_v2_line_event)
+        buf = memoryview(self._staging).cast("B")
+
+        try:
+            while True:
+                for fd, mask in epoll.poll():
+                    if fd == self._wake[0]:
+                        return
+
+                    assert not mask & select.EPOLLERR, "EPOLLERR"
+                    ret = self._lines._file.readinto(buf)
+                    assert ret and ret % size == 0
+                    self._store(ret // size)
+        finally:
+            epoll.close()
+
+    def _store(self, n):
+        events = self._staging
+        capacity = len(self._ring)
+        size = sizeof(gpio_v2_line_event)
+
+        first_seqno = self._seqno + 1 if self._seqno else events[0].seqno
+        self._seqno = events[n - 1].seqno
+        self._dropped += (self._seqno - first_seqno - n + 1) & U32_MAX
+
+        with self._cond:
+            take = min(n, capacity - self._count)
+            self._overruns += n - take
+            tail = (self._head + self._count) % capacity
+            first = min(take, capacity - tail)
+            dst = addressof(self._ring)
+            src = addressof(events)
+            memmove(dst + tail * size, src, first * size)
+            memmove(dst, src + first * size, (take - first) * size)
+            self._count += take
+
+            if take:
+                self._cond.notify_all()
+
+    def read(
+        self, max_events: int = 64, timeout: Optional[float] = None
+    ) -> Optional["Array[gpio_v2_line_event]"]:
+        """
+        Wait for captured events and take up to max_events of the oldest ones.
+        The returned array is a view into a buffer that is reused by the next call.
+        """
+        assert 0 < max_events <= U32_MAX, "max_events out of range"
+
+        if len(self._out) < max_events:
+            self._out = (gpio_v2_line_event * max_events)()
+
+        capacity = len(self._ring)
+        size = sizeof(gpio_v2_line_event)
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._count, timeout):
+                return None
+
+            n = min(max_events, self._count)
+            first = min(n, capacity - self._head)
+            dst = addressof(self._out)
+            src = addressof(self._ring)
+            memmove(dst, src + self._head * size, first * size)
+            memmove(dst + first * size, src, (n - first) * size)
+            self._head = (self._head + n) % capacity
+            self._count -= n
+
+        return (gpio_v2_line_event * n).from_buffer(self._out)
+
+
+class _Timer:
+    _libc = None
+
+    def __init__(self, period_ns=0):
+        if not _Timer._libc:
+            _Timer._libc = CDLL(None, use_errno=True)
+
+        fd = self._libc.timerfd_create(time.CLOCK_MONOTONIC, TFD_CLOEXEC)
+
+        if fd < 0:
+            raise OSError(get_errno(), os.strerror(get_errno()))
+
+        self._file = FileIO(fd)
+
+        if period_ns:
+            try:
+                self.arm(period_ns, period_ns)
+            except OSError:
+                self._file.close()
+                raise
+
+    def arm(self, value_ns, interval_ns=0, flags=0):
+        """
+        Set the first expiration, relative or absolute with TFD_TIMER_ABSTIME,
+        and the period of the following ones.
+        """
+        value = timespec(*divmod(value_ns, 1_000_000_000))
+        interval = timespec(*divmod(interval_ns, 1_000_000_000))
+        spec = itimerspec(it_interval=interval, it_value=value)
+
+        if (
+            self._libc.timerfd_settime(self._file.fileno(), flags, byref(spec), None)
+            < 0
+        ):
+            raise OSError(get_errno(), os.strerror(get_errno()))
+
+    def wait(self):
+        """
+        Wait for the timer to expire and return the number of expirations.
+        """
+        return int.from_bytes(self._file.read(8), sys.byteorder)
+
+    def close(self):
+        """
+        Release the timerfd.
+        """
+        self._file.close()
+
+
+class Player:
+    """
+    Play back a sequence of (bits, mask) steps on a set of GPIO lines from a
+    background thread, paced by a timerfd.
+    """
+
+    def __init__(
+        self,
+        lines: Lines,
+        sequence: Sequence[Tuple[int, int]],
+        period_ns: int,
+        cpu: Optional[int] = None,
+    ):
+        """
+        Constructor is subject to change; use Lines.play().
+        """
+        assert 0 < period_ns, "period_ns out of range"
+
+        for bits, mask in sequence:
+            assert 0 <= bits <= U64_MAX, "bits out of range"
+            assert 0 <= mask <= U64_MAX, "mask out of range"
+
+        self._lines = lines
+        self._sequence = list(sequence)
+        self._period_ns = period_ns
+        self._cpu = cpu
+        self._stopped = False
+        self._report: Optional[Dict] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """
+        Start playback.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop playback after the current step.
+        """
+        self._stopped = True
+
+    def join(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        Wait for playback to finish and return a report of the achieved timing.
+        """
+        self._thread.join(timeout)
+        return self._report
+
+    def _run(self):
+        if self._cpu is not None:
+            os.sched_setaffinity(0, [self._cpu])
+
+        set_bits = self._lines.set_bits_unchecked
+        period = self._period_ns
+        timer = _Timer(period)
+        start = time.monotonic_ns()
+        ticks = 0
+        missed = 0
+        total_late = 0
+        max_late = 0
+        steps = 0
+
+        try:
+            for bits, mask in self._sequence:
+                if self._stopped:
+                    break
+
+                n = timer.wait()
+                set_bits(bits, mask)
+                late = time.monotonic_ns() - start - (ticks + n) * period
+                ticks += n
+                missed += n - 1
+                total_late += late
+                max_late = max(max_late, late)
+                steps += 1
+        finally:
+            timer.close()
+
+        self._report = {
+            "steps": steps,
+            "period_ns": period,
+            "elapsed_ns": time.monotonic_ns() - start,
+            "missed": missed,
+            "max_late_ns": max_late,
+            "mean_late_ns": total_late // steps if steps else 0,
+        }
+
+
+_Events = typing.Union[
+    "Array[gpio_v2_line_event]", gpio_v2_line_event, LineEvent, Iterable[LineEvent]
+]
+
+
+def _raw_events(events):
+    if isinstance(events, gpio_v2_line_event):
+        return (gpio_v2_line_event * 1).from_buffer(events)
+
+    if isinstance(events, LineEvent):
+        events = (events,)
+    elif isinstance(events, Array):
+        return events
+
+    events = list(events)
+    return (gpio_v2_line_event * len(events))(*(gpio_v2_line_event(*e) for e in events))
+
+
+class Recorder:
+    """
+    Append edge events to a compact binary file: a header with chip and line
+    metadata, followed by raw gpio_v2_line_event records. Read it with Recording.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        offsets: Sequence[int] = (),
+        chip_name: str = "",
+        buffer_size: int = 1 << 16,
+    ):
+        assert len(offsets) <= GPIO_V2_LINES_MAX, "too many lines"
+        header = _recording_header(
+            magic=RECORDING_MAGIC,
+            version=RECORDING_VERSION,
+            num_lines=len(offsets),
+            realtime_ns=time.time_ns(),
+            monotonic_ns=time.monotonic_ns(),
+            chip=chip_name.encode()[:GPIO_MAX_NAME_SIZE],
+        )
+        header.offsets[: len(offsets)] = offsets
+        self._file = BufferedWriter(FileIO(path, "w"), buffer_size)
+        self._file.write(header)
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, events: _Events):
+        """
+        Append one event or a batch, e.g. from Lines.wait(), Lines.read_events() or
+        Capture.read(). Batches of raw events are written without conversion.
+        """
+        raw = _raw_events(events)
+        self.count += len(raw)
+        self._file.write(raw)
+
+    def flush(self):
+        """
+        Write buffered events to the file.
+        """
+        self._file.flush()
+
+    def close(self):
+        """
+        Flush and close the file.
+        """
+        self._file.close()
+
+
+class Recording:
+    """
+    Memory-mapped view of a file written by Recorder. The events are exposed
+    without copying; the file itself is never modified.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        header = _recording_header.from_buffer_copy(self._mmap)
+        assert header.magic == RECORDING_MAGIC, "not a recording"
+        assert header.version == RECORDING_VERSION, "unsupported version"
+        self.chip = header.chip.decode(errors="replace")
+        self.offsets = list(header.offsets[: header.num_lines])
+        self.realtime_ns = header.realtime_ns
+        self.monotonic_ns = header.monotonic_ns
+        num_events = (len(self._mmap) - sizeof(header)) // sizeof(gpio_v2_line_event)
+        self.events = (gpio_v2_line_event * num_events).from_buffer(
+            self._mmap, sizeof(header)
+        )
+
+    def __len__(self):
+        return len(self.events)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def array(self):
+        """
+        Get the events as a NumPy structured array sharing memory with the file.
+        """
+        return event_array(self.events)
+
+    def replay(
+        self,
+        lines: Lines,
+        offsets: Optional[Dict[int, int]] = None,
+        speed: float = 1.0,
+        cpu: Optional[int] = None,
+    ) -> "Replay":
+        """
+        Start re-emitting the recorded edges with their original timing on output lines.
+        Recorded offsets are mapped to offsets of lines, by default one to one.
+        """
+        replay = Replay(lines, self.events, offsets, speed=speed, cpu=cpu)
+        replay.start()
+        return replay
+
+    def close(self):
+        """
+        Unmap the file. Views returned by events or array() must be released first.
+        """
+        del self.events
+        self._mmap.close()
+
+
+class Replay:
+    """
+    Re-emit edge events through set_bits() on a set of GPIO lines from a background
+    thread, at the times given by their timestamps, paced by a timerfd.
+    """
+
+    def __init__(
+        self,
+        lines: Lines,
+        events: Iterable,
+        offsets: Optional[Dict[int, int]] = None,
+        speed: float = 1.0,
+        cpu: Optional[int] = None,
+    ):
+        """
+        Constructor is subject to change; use Recording.replay().
+        """
+        assert 0 < speed, "speed out of range"
+        self._lines = lines
+        self._steps = self._compile(lines, events, offsets, speed)
+        self._cpu = cpu
+        self._stopped = False
+        self._report: Optional[Dict] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _compile(lines, events, offsets, speed):
+        steps = []
+        first = None
+
+        for event in events:
+            offset = offsets.get(event.offset) if offsets else event.offset
+            bit = lines._bit_offsets.get(offset)
+
+            if bit is None:
+                continue
+
+            if first is None:
+                first = event.timestamp_ns
+
+            at = int((event.timestamp_ns - first) / speed)
+            value = int(event.id == LineEventId.RISING_EDGE) << bit
+
+            if steps and steps[-1][0] == at:
+                steps[-1][1] = steps[-1][1] & ~(1 << bit) | value
+                steps[-1][2] |= 1 << bit
+            else:
+                steps.append([at, value, 1 << bit])
+
+        return steps
+
+    def start(self):
+        """
+        Start replay.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop replay after the current step.
+        """
+        self._stopped = True
+
+    def join(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        Wait for replay to finish and return a report of the achieved timing.
+        """
+        self._thread.join(timeout)
+        return self._report
+
+    def _run(self):
+        if self._cpu is not None:
+            os.sched_setaffinity(0, [self._cpu])
+
+        set_bits = self._lines.set_bits_unchecked
+        timer = _Timer()
+        start = time.monotonic_ns()
+        total_late = 0
+        max_late = 0
+        steps = 0
+
+        try:
+            for at, bits, mask in self._steps:
+                if self._stopped:
+                    break
+
+                if at:
+                    timer.arm(start + at, flags=TFD_TIMER_ABSTIME)
+                    timer.wait()
+
+                set_bits(bits, mask)
+                late = time.monotonic_ns() - start - at
+                total_late += late
+                max_late = max(max_late, late)
+                steps += 1
+        finally:
+            timer.close()
+
+        self._report = {
+            "steps": steps,
+            "elapsed_ns": time.monotonic_ns() - start,
+            "max_late_ns": max_late,
+            "mean_late_ns": total_late // steps if steps else 0,
+        }
+
+
+# Preallocated buffers and counters are shared with the sampling thread.
+class Sampler:  # pylint: disable=too-many-instance-attributes
+    """
+    Sample GPIO line states at a fixed rate from a background thread, paced by a timerfd.
+    Samples and CLOCK_MONOTONIC timestamps are collected into preallocated arrays
+    and passed to the callback in chunks. With compress, only samples that differ
+    from the previous one are kept.
+
+    The callback gets memoryviews over those preallocated arrays, which the next
+    chunk overwrites, so it must copy (e.g. tolist() or bytes()) whatever it keeps.
+    """
+
+    def __init__(
+        self,
+        lines: Lines,
+        callback: Callable[[memoryview, memoryview], None],
+        rate_hz: float,
+        *,
+        mask: int = U64_MAX,
+        chunk: int = 4096,
+        compress: bool = False,
+    ):
+        assert 0 < rate_hz <= 1_000_000_000, "rate_hz out of range"
+        assert 0 <= mask <= U64_MAX, "mask out of range"
+        assert 0 < chunk <= U32_MAX, "chunk out of range"
+        self._lines = lines
+        self._callback = callback
+        self._period_ns = round(1_000_000_000 / rate_hz)
+        self._mask = mask
+        self._compress = compress
+        self._timestamps = array("Q", bytes(8 * chunk))
+        self._values = array("Q", bytes(8 * chunk))
+        self._samples = 0
+        self._missed = 0
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def samples(self) -> int:
+        """
+        Number of samples taken, including ones dropped by compression.
+        """
+        return self._samples
+
+    @property
+    def missed(self) -> int:
+        """
+        Number of sample periods skipped because sampling fell behind.
+        """
+        return self._missed
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        Start sampling.
+        """
+        assert not self._thread, "already started"
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling. The remaining partial chunk is passed to the callback.
+        """
+        assert self._thread, "not started"
+        self._stopped = True
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        get_bits = self._lines.get_bits_unchecked
+        monotonic_ns = time.monotonic_ns
+        mask = self._mask
+        compress = self._compress
+        timestamps = self._timestamps
+        values = self._values
+        chunk = len(values)
+        timer = _Timer(self._period_ns)
+        last = -1
+        n = 0
+
+        try:
+            while not self._stopped:
+                self._missed += timer.wait() - 1
+                bits = get_bits(mask)
+                self._samples += 1
+
+                if compress and bits == last:
+                    continue
+
+                last = bits
+                timestamps[n] = monotonic_ns()
+                values[n] = bits
+                n += 1
+
+                if n == chunk:
+                    self._callback(memoryview(timestamps), memoryview(values))
+                    n = 0
+        finally:
+            timer.close()
+
+            if n:
+                self._callback(memoryview(timestamps)[:n], memoryview(values)[:n])
+
+
+def _event_dtype(numpy):
+    return numpy.dtype(
+        {
+            "names": [name for (name, _) in gpio_v2_line_event._fields_],
+            "formats": ["u8", "u4", "u4", "u4", "u4", ("u4", 6)],
+            "offsets": [
+                getattr(gpio_v2_line_event, name).offset
+                for (name, _) in gpio_v2_line_event._fields_
+            ],
+            "itemsize": sizeof(gpio_v2_line_event),
+        }
+    )
+
+
+def event_array(events: _Events):
+    """
+    Get edge events as a NumPy structured array with the fields of gpio_v2_line_event.
+    Raw event arrays, e.g. from Lines.read_events(), are wrapped without copying.
+    """
+    numpy = _numpy()
+    return numpy.frombuffer(_raw_events(events), dtype=_event_dtype(numpy))
+
+
+def line_edges(events: _Events) -> dict:
+    """
+    Split edge events by line into a dict of offset: (timestamps_ns, levels) arrays,
+    where levels is the bool level of the line after each edge.
+    """
+    numpy = _numpy()
+    records = event_array(events)
+    ret = {}
+
+    for offset in numpy.unique(records["offset"]):
+        selected = records[records["offset"] == offset]
+        levels = selected["id"] == LineEventId.RISING_EDGE
+        ret[int(offset)] = (selected["timestamp_ns"].astype(numpy.int64), levels)
+
+    return ret
+
+
+def pulse_stats(timestamps_ns, levels) -> dict:
+    """
+    Measure one line from its edges as returned by line_edges(): the widths of its
+    high and low pulses, the periods between rising edges and the duty cycle of
+    each period, all in ns except duty_cycle.
+    """
+    numpy = _numpy()
+    timestamps_ns = numpy.asarray(timestamps_ns, dtype=numpy.int64)
+    levels = numpy.asarray(levels, dtype=bool)
+    widths = numpy.diff(timestamps_ns)
+    rising = timestamps_ns[levels]
+    falling = timestamps_ns[~levels]
+    period = numpy.diff(rising)
+    index = numpy.searchsorted(falling, rising[:-1], side="right")
+    valid = index < len(falling)
+    high = numpy.zeros(len(period), dtype=numpy.int64)
+    high[valid] = falling[index[valid]] - rising[:-1][valid]
+    valid &= high < period
+
+    return {
+        "high_ns": widths[levels[:-1]],
+        "low_ns": widths[~levels[:-1]],
+        "period_ns": period,
+        "duty_cycle": numpy.where(valid, high / numpy.maximum(period, 1), numpy.nan),
+    }
+
+
+def edge_stats(events: _Events) -> dict:
+    """
+    Apply pulse_stats() to each line of a batch of edge events, keyed by offset.
+    """
+    return dict((k, pulse_stats(*v)) for (k, v) in line_edges(events).items())
+
+
+def sample_levels(values, lines: Lines, offsets: Optional[List[int]] = None):
+    """
+    Decode get_bits() samples, e.g. the values passed to a Sampler callback, into a
+    bool array with one row per sample and one column per offset, the array form of
+    Lines.get(). By default all offsets of lines are used, in request order.
+    """
+    numpy = _numpy()
+
+    if offsets is None:
+        offsets = list(lines._bit_offsets)
+
+    bits = numpy.array([lines._bit_offsets[k] for k in offsets], dtype=numpy.uint64)
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    return (values[..., None] >> bits & 1).astype(bool)
+
+
+class _Engine:
+    def __init__(self, lines, feed, batch):
+        assert 0 < batch <= U32_MAX, "batch out of range"
+        self._lines = lines
+        self._feed = feed
+        self._batch = batch
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = (-1, -1)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """
+        Start feeding events from a background thread, which must be the only
+        reader of the line request.
+        """
+        assert not self._thread, "already started"
+        self._wake = os.pipe()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread.
+        """
+        assert self._thread, "not started"
+        os.write(self._wake[1], b"\0")
+        self._thread.join()
+        self._thread = None
+
+        for fd in self._wake:
+            os.close(fd)
+
+    def _run(self):
+        lines = self._lines
+        epoll = select.epoll()
+        epoll.register(lines.fileno(), select.EPOLLIN)
+        epoll.register(self._wake[0], select.EPOLLIN)
+
+        try:
+            while True:
+                debouncer = lines._debouncer
+                timeout = debouncer.timeout() if debouncer is not None else None
+
+                for fd, mask in epoll.poll(timeout):
+                    if fd == self._wake[0]:
+                        return
+
+                    assert not mask & select.EPOLLERR, "EPOLLERR"
+                    events = lines._read_events(self._batch)
+
+                    if debouncer is None:
+                        self._feed(events)
+                    else:
+                        debouncer.feed(events)
+
+                if debouncer is not None:
+                    events = debouncer.take(self._batch)
+
+                    while events:
+                        self._feed(events)
+                        events = debouncer.take(self._batch)
+        finally:
+            epoll.close()
+
+
+class Counter(_Engine):
+    """
+    Count edge events per line and measure their frequency, from batches of events.
+    Counts follow line_seqno, so events lost in the kernel are still counted, except
+    on lines debounced in software, whose suppressed edges leave gaps as well.
+    """
+
+    def __init__(self, lines: Lines, batch: int = 64):
+        super().__init__(lines, self.feed, batch)
+        self._counts = dict((k, 0) for k in lines._bit_offsets)
+        self._line_seqnos = dict((k, 0) for k in lines._bit_offsets)
+        self._timestamps = dict((k, 0) for k in lines._bit_offsets)
+        self._marks = dict((k, (0, 0)) for k in lines._bit_offsets)
+
+    def feed(self, events: Iterable):
+        """
+        Process a batch of edge events, e.g. from Lines.read_events().
+        """
+        counts = self._counts
+        line_seqnos = self._line_seqnos
+        timestamps = self._timestamps
+        debounced = self._lines._debounced()
+
+        with self._lock:
+            for event in events:
+                offset = event.offset
+                last = line_seqnos[offset]
+
+                if last and offset not in debounced:
+                    counts[offset] += (event.line_seqno - last) & U32_MAX
+                else:
+                    counts[offset] += 1
+
+                line_seqnos[offset] = event.line_seqno
+                timestamps[offset] = event.timestamp_ns
+
+    def snapshot(self) -> Dict[int, Dict]:
+        """
+        Get the count of each line, the timestamp of its last event and its frequency
+        in edges per second over the events since the previous snapshot.
+        """
+        ret = {}
+
+        with self._lock:
+            for offset, count in self._counts.items():
+                timestamp = self._timestamps[offset]
+                mark_count, mark_timestamp = self._marks[offset]
+                elapsed = timestamp - mark_timestamp
+
+                ret[offset] = {
+                    "count": count,
+                    "timestamp_ns": timestamp,
+                    "frequency_hz": (
+                        (count - mark_count) * 1e9 / elapsed
+                        if mark_timestamp and elapsed
+                        else 0.0
+                    ),
+                }
+
+                if timestamp != mark_timestamp:
+                    self._marks[offset] = (count, timestamp)
+
+        return ret
+
+
+def _quadrature_table():
+    table = []
+
+    for key in range(16):
+        state, line, rising = key >> 2, key >> 1 & 1, key & 1
+        bit = 2 >> line
+        new = state | bit if rising else state & ~bit
+
+        if new == state:
+            table.append((new, 0, 1))
+        else:
+            forward = (state, new) in ((0, 2), (2, 3), (3, 1), (1, 0))
+            table.append((new, 1 if forward else -1, 0))
+
+    return tuple(table)
+
+
+# Decoder state is kept in flat attributes for the per-event loop.
+class QuadratureDecoder(_Engine):  # pylint: disable=too-many-instance-attributes
+    """
+    Track the position of a rotary encoder from batches of edge events on its A and B
+    lines, at four counts per cycle. The position increases when A leads B.
+    Events on any other line of the request are ignored.
+    """
+
+    # Indexed by state << 2 | line << 1 | rising, where state is A << 1 | B and line
+    # is 0 for A, 1 for B; each entry is (new state, position delta, error).
+    TABLE = _quadrature_table()
+
+    def __init__(self, lines: Lines, a: int, b: int, batch: int = 64):
+        assert a != b, "a and b must differ"
+        super().__init__(lines, self.feed, batch)
+        levels = lines.get_bits(
+            (1 << lines._bit_offsets[a]) | (1 << lines._bit_offsets[b])
+        )
+        self._line_keys = {a: 0, b: 2}
+        self._state = (levels >> lines._bit_offsets[a] & 1) << 1
+        self._state |= levels >> lines._bit_offsets[b] & 1
+        self._position = 0
+        self._errors = 0
+        self._missed = 0
+        self._timestamp = 0
+        self._line_seqnos = {a: 0, b: 0}
+        self._mark = (0, 0)
+
+    def feed(self, events: Iterable):
+        """
+        Process a batch of edge events, e.g. from Lines.read_events().
+        """
+        table = self.TABLE
+        line_keys = self._line_keys
+        rising = LineEventId.RISING_EDGE
+        line_seqnos = self._line_seqnos
+        debounced = self._lines._debounced()
+
+        with self._lock:
+            state = self._state
+            position = self._position
+            errors = 0
+
+            for event in events:
+                key = line_keys.get(event.offset)
+
+                if key is None:
+                    continue
+
+                key |= state << 2 | (event.id == rising)
+                state, delta, error = table[key]
+                position += delta
+                errors += error
+                last = line_seqnos[event.offset]
+
+                # Edges suppressed by software debounce are not lost.
+                if last and event.offset not in debounced:
+                    self._missed += (event.line_seqno - last - 1) & U32_MAX
+
+                line_seqnos[event.offset] = event.line_seqno
+                self._timestamp = event.timestamp_ns
+
+            self._state = state
+            self._position = position
+            self._errors += errors
+
+    def snapshot(self) -> Dict:
+        """
+        Get the position, the velocity in counts per second over the events since the
+        previous snapshot, the timestamp of the last event, and the number of
+        invalid transitions and events lost in the kernel.
+        """
+        with self._lock:
+            mark_position, mark_timestamp = self._mark
+            elapsed = self._timestamp - mark_timestamp
+            ret = {
+                "position": self._position,
+                "velocity": (
+                    (self._position - mark_position) * 1e9 / elapsed
+                    if mark_timestamp and elapsed
+                    else 0.0
+                ),
+                "timestamp_ns": self._timestamp,
+                "errors": self._errors,
+                "missed": self._missed,
+            }
+
+            if self._timestamp != mark_timestamp:
+                self._mark = (self._position, self._timestamp)
+
+        return ret
+
+
+class LineGroup:
+    """
+    Abstraction over GPIO lines from several requests, possibly on several chips,
+    behind one bitmask of arbitrary width. Bits are assigned in the order of the
+    requests, and within a request in the order of its offsets.
+    """
+
+    def __init__(self, lines: Sequence[Lines], threads: bool = False):
+        """
+        Slow requests, e.g. on I2C expanders, can be accessed in parallel threads.
+        """
+        parts = []
+        shift = 0
+
+        for line in lines:
+            width = len(line._bit_offsets)
+            parts.append((line, shift, (1 << width) - 1))
+            shift += width
+
+        self._parts = tuple(parts)
+        self._width = shift
+        # Threads only pay off, and are only used, with more than one request.
+        self._executor = None
+
+        if threads and len(parts) > 1:
+            # Imported here to keep the import of this module light.
+            # pylint: disable-next=import-outside-toplevel
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._executor = ThreadPoolExecutor(len(parts))
+
+    def __len__(self):
+        return self._width
+
+    def get_bits(self, mask: int) -> int:
+        """
+        Get GPIO line states as a bitmask.
+        """
+        assert 0 <= mask < 1 << self._width, "mask out of range"
+        parts = [
+            (line, shift, mask >> shift & width_mask)
+            for (line, shift, width_mask) in self._parts
+            if mask >> shift & width_mask
+        ]
+
+        if self._executor and len(parts) > 1:
+            results = self._executor.map(
+                lambda p: p[0].get_bits_unchecked(p[2]) << p[1], parts
+            )
+            return sum(results)
+
+        bits = 0
+
+        for line, shift, part_mask in parts:
+            bits |= line.get_bits_unchecked(part_mask) << shift
+
+        return bits
+
+    def set_bits(self, bits: int, mask: int):
+        """
+        Set GPIO line states from a bitmask.
+        """
+        assert 0 <= bits < 1 << self._width, "bits out of range"
+        assert 0 <= mask < 1 << self._width, "mask out of range"
+        parts = [
+            (line, bits >> shift & width_mask, mask >> shift & width_mask)
+            for (line, shift, width_mask) in self._parts
+            if mask >> shift & width_mask
+        ]
+
+        if self._executor and len(parts) > 1:
+            for f in [
+                self._executor.submit(line.set_bits_unchecked, part_bits, part_mask)
+                for (line, part_bits, part_mask) in parts
+            ]:
+                f.result()
+        else:
+            for line, part_bits, part_mask in parts:
+                line.set_bits_unchecked(part_bits, part_mask)
+
+    def close(self):
+        """
+        Stop the worker threads, if any.
+        """
+        if self._executor:
+            self._executor.shutdown()
+
+
+def request_group(
+    lines: Sequence[Tuple[Chip, List[int]]], threads: bool = False, **kwargs
+) -> LineGroup:
+    """
+    Configure GPIO lines on one or more chips as a LineGroup. Offsets on each chip
+    are split into requests of at most GPIO_V2_LINES_MAX lines. Other arguments
+    are as for Chip.request(), with bitmasks in attrs applying to each request.
+    """
+    requests = []
+
+    for c, offsets in lines:
+        for i in range(0, len(offsets), GPIO_V2_LINES_MAX):
+            requests.append(c.request(offsets[i : i + GPIO_V2_LINES_MAX], **kwargs))
+
+    return LineGroup(requests, threads=threads)
+
+
+# Precomputed frames and masks keep write() down to one ioctl per half clock.
+class Spi:  # pylint: disable=too-many-instance-attributes
+    """
+    Bit-banged SPI master on a set of GPIO output lines, also usable for driving
+    shift register chains, with the chip select line acting as the latch.
+    Clock and data steps are precomputed per byte value.
+    """
+
+    def __init__(
+        self,
+        lines: Lines,
+        clock: int,
+        mosi: int,
+        *,
+        miso: Optional[int] = None,
+        cs: Optional[int] = None,
+        mode: int = 0,
+        lsb_first: bool = False,
+    ):
+        assert 0 <= mode <= 3, "mode out of range"
+
+        def bit(offset):
+            assert offset in lines._bit_offsets, f"offset {offset} not configured"
+            return 1 << lines._bit_offsets[offset]
+
+        self._lines = lines
+        self._miso = bit(miso) if miso is not None else 0
+        self._lsb_first = lsb_first
+        self._bit_rate = 0.0
+        clk = bit(clock)
+        cs_bit = bit(cs) if cs is not None else 0
+        idle = clk if mode & 2 else 0
+        active = idle ^ clk
+        first, second = (active, idle) if mode & 1 else (idle, active)
+        self._mask = clk | bit(mosi) | cs_bit
+        self._start = idle
+        self._end = idle | cs_bit
+        self._table = [self._steps(v, bit(mosi), first, second) for v in range(256)]
+
+    def _steps(self, value, mosi, first, second):
+        steps = []
+
+        for i in range(8):
+            data = mosi if value >> (i if self._lsb_first else 7 - i) & 1 else 0
+            steps.append(data | first)
+            steps.append(data | second)
+
+        return tuple(steps)
+
+    @property
+    def bit_rate(self) -> float:
+        """
+        Bits per second achieved by the last write() or transfer().
+        """
+        return self._bit_rate
+
+    def frames(self, data: bytes) -> List[int]:
+        """
+        Get the line states to be written in turn for the given data,
+        all under the same mask.
+        """
+        table = self._table
+        frames = [self._start]
+        frames.extend(chain.from_iterable(table[b] for b in data))
+        frames.append(self._end)
+        return frames
+
+    def write(self, data: bytes):
+        """
+        Shift out the given data.
+        """
+        frames = self.frames(data)
+        set_bits = self._lines.set_bits_unchecked
+        mask = self._mask
+        start = time.perf_counter_ns()
+
+        for bits in frames:
+            set_bits(bits, mask)
+
+        elapsed = time.perf_counter_ns() - start
+        self._bit_rate = len(data) * 8e9 / elapsed if elapsed else 0.0
+
+    def transfer(self, data: bytes) -> bytes:
+        """
+        Shift out the given data while shifting in as many bytes from MISO.
+        """
+        assert self._miso, "miso not configured"
+        frames = self.frames(data)
+        set_bits = self._lines.set_bits_unchecked
+        get_bits = self._lines.get_bits_unchecked
+        mask = self._mask
+        miso = self._miso
+        bits_in = []
+        start = time.perf_counter_ns()
+        set_bits(frames[0], mask)
+
+        for i in range(1, len(frames) - 1, 2):
+            set_bits(frames[i], mask)
+            set_bits(frames[i + 1], mask)
+            bits_in.append(get_bits(miso))
+
+        set_bits(frames[-1], mask)
+        elapsed = time.perf_counter_ns() - start
+        self._bit_rate = len(data) * 8e9 / elapsed if elapsed else 0.0
+        ret = bytearray(len(data))
+
+        for i, b in enumerate(bits_in):
+            if b:
+                ret[i >> 3] |= 1 << (i & 7 if self._lsb_first else 7 - (i & 7))
+
+        return bytes(ret)
+
+
+class _LineIndex:
+    def __init__(self):
+        self._chips = None
+
+    def _scan(self):
+        paths = glob("/dev/gpiochip*")
+        paths.sort(key=lambda p: int(p[len("/dev/gpiochip") :]))
+        self._chips = dict((p, Chip(p)) for p in paths)
+
+    def find(self, name):
+        """
+        Find a line by name, rebuilding the stale name index of a chip if needed.
+        """
+        if self._chips is None:
+            self._scan()
+
+        for path, c in self._chips.items():
+            offset = c.find_line(name)
+
+            if (
+                offset is not None
+                and c._line_field(c._get_line_info(offset), "name") != name
+            ):
+                c._names = None
+                offset = c.find_line(name)
+
+            if offset is not None:
+                return (path, offset)
+
+        return None
+
+    def clear(self):
+        """
+        Close all indexed chips.
+        """
+        if self._chips:
+            for c in self._chips.values():
+                c.close()
+
+        self._chips = None
+
+
+_line_index = _LineIndex()
+
+
+def find_line(name: str) -> Optional[Tuple[str, int]]:
+    """
+    Find the first line with the given name on any GPIO chip and return the chip path
+    and line offset. Line names are indexed on first use; each hit is revalidated.
+    """
+    return _line_index.find(name)
+
+
+def clear_line_index():
+    """
+    Forget indexed line names, e.g. after GPIO chips have been added or removed.
+    """
+    _line_index.clear()
+
+
+class _BrokerOp(IntEnum):
+    HELLO = 0
+    GET = 1
+    VALUES = 2
+    SET = 3
+    SUBSCRIBE = 4
+    EVENTS = 5
+    ERROR = 6
+
+
+# Every message is one SOCK_SEQPACKET packet: op, arg, a and b, followed by the line
+# offsets for HELLO or arg raw gpio_v2_line_event records for EVENTS. Writes are not
+# answered; ERROR replies to the next GET in place of VALUES, so that every GET gets
+# exactly one reply.
+_BROKER_FRAME = struct.Struct("=BxxxIQQ")
+
+_BROKER_PACKET_MAX = _BROKER_FRAME.size + 64 * sizeof(gpio_v2_line_event)
+
+
+# Owns the socket, the selector and per-round write bookkeeping.
+class Broker:  # pylint: disable=too-many-instance-attributes
+    """
+    Serve get, set and edge event subscriptions for a set of GPIO lines to other
+    processes over a Unix domain socket, so that several processes can share
+    lines that the kernel only lets one of them request. Clients use RemoteLines.
+    Writes arriving together are coalesced into a single ioctl per request; a client
+    writing to lines not configured as outputs gets EPERM without affecting others.
+    """
+
+    def __init__(self, path: str, lines: Sequence[Lines]):
+        """
+        Bits are assigned as in LineGroup, and offsets must be unique.
+        """
+        self._lines = list(lines)
+        self._group = LineGroup(self._lines)
+        offsets = [k for line in self._lines for k in line._bit_offsets]
+        assert len(offsets) <= 64, "too many lines"
+        assert len(set(offsets)) == len(offsets), "duplicate offset"
+        self._offsets = offsets
+        self._bit_offsets = dict((v, i) for (i, v) in enumerate(offsets))
+        self._hello = _BROKER_FRAME.pack(_BrokerOp.HELLO, len(offsets), 0, 0) + bytes(
+            array("I", offsets)
+        )
+        self._path = path
+        self._clients: Dict[int, List] = {}
+        self._writers: List[int] = []
+        self.dropped = 0
+        self._socket = socket.socket(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET | socket.SOCK_CLOEXEC
+        )
+        self._socket.bind(path)
+        self._socket.listen()
+        self._wake = os.pipe()
+        self._serving = threading.RLock()
+        self._stopping = False
+        self._selector = Selector()
+        self._selector.register(_Handle(self._socket.fileno()), self._accept)
+        self._selector.register(_Handle(self._wake[0]), self._woken)
+
+        for line in self._lines:
+            self._selector.register(
+                _Handle(line.fileno()), lambda fd, line=line: self._publish(line)
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def serve(self, timeout: Optional[float] = None) -> int:
+        """
+        Wait for requests and events once and handle all that are pending.
+        Returns the number of sources that had something pending.
+        """
+        debounced = [line for line in self._lines if line._debouncer is not None]
+
+        for line in debounced:
+            due = line._debouncer.timeout()
+
+            if due is not None and (timeout is None or due < timeout):
+                timeout = due
+
+        self._writers = []
+        ret = 0
+
+        try:
+            with ExitStack() as stack:
+                for line in self._lines:
+                    stack.enter_context(line.batch())
+
+                ret = self._selector.dispatch(timeout)
+        except OSError as e:
+            self._fail_writers(e.errno or errno.EIO)
+
+        for line in debounced:
+            self._publish(line)
+
+        return ret
+
+    def serve_forever(self):
+        """
+        Handle requests and events until stop() or close() is called,
+        e.g. from another thread.
+        """
+        with self._serving:
+            while not self._stopping:
+                self.serve()
+
+            self._stopping = False
+
+    def stop(self):
+        """
+        Make serve_forever() return after the current round.
+        """
+        os.write(self._wake[1], b"\0")
+
+    def close(self):
+        """
+        Disconnect all clients and remove the socket. The lines are not released.
+        If serve_forever() runs in another thread, it is stopped first.
+        """
+        self.stop()
+
+        with self._serving:
+            self._stopping = True
+
+            for fd in list(self._clients):
+                self._drop(fd)
+
+            self._selector.close()
+            self._socket.close()
+            os.unlink(self._path)
+
+            for fd in self._wake:
+                os.close(fd)
+
+    def _woken(self, fd):
+        os.read(fd, 64)
+        self._stopping = True
+
+    def _writable(self):
+        outputs = 0
+
+        for line, shift, width_mask in self._group._parts:
+            outputs |= (line._outputs & width_mask) << shift
+
+        return outputs
+
+    def _accept(self, _):
+        conn, _ = self._socket.accept()
+        # Connection, subscribed mask and errno of the first failed write.
+        self._clients[conn.fileno()] = [conn, 0, 0]
+        self._selector.register(_Handle(conn.fileno()), self._receive)
+        self._send(conn.fileno(), self._hello)
+
+    def _drop(self, fd):
+        conn = self._clients.pop(fd)[0]
+        self._selector.unregister(_Handle(fd))
+        conn.close()
+
+    def _send(self, fd, packet, flags=0):
+        client = self._clients.get(fd)
+
+        if client is None:
+            return False
+
+        try:
+            client[0].send(packet, flags)
+        except BlockingIOError:
+            return False
+        except OSError:
+            self._drop(fd)
+            return False
+
+        return True
+
+    def _receive(self, fd):
+        client = self._clients[fd]
+
+        # A reply that fails drops the client.
+        while fd in self._clients:
+            try:
+                packet = client[0].recv(_BROKER_FRAME.size, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return
+            except OSError:
+                packet = b""
+
+            if len(packet) != _BROKER_FRAME.size:
+                self._drop(fd)
+                return
+
+            op, _, a, b = _BROKER_FRAME.unpack(packet)
+
+            if op == _BrokerOp.SET:
+                mask = b & (1 << len(self._offsets)) - 1
+
+                if mask & ~self._writable():
+                    client[2] = client[2] or errno.EPERM
+                    continue
+
+                self._writers.append(fd)
+                self._group.set_bits(a & mask, mask)
+            elif op == _BrokerOp.GET:
+                self._get(fd, a & (1 << len(self._offsets)) - 1)
+            elif op == _BrokerOp.SUBSCRIBE:
+                client[1] = a
+            else:
+                client[2] = client[2] or errno.EINVAL
+
+    def _fail_writers(self, error):
+        for fd in self._writers:
+            client = self._clients.get(fd)
+
+            if client is not None:
+                client[2] = client[2] or error
+
+        self._writers = []
+
+    def _get(self, fd, mask):
+        try:
+            for line in self._lines:
+                line.flush()
+
+            self._writers = []
+        except OSError as e:
+            self._fail_writers(e.errno or errno.EIO)
+
+        client = self._clients[fd]
+
+        if client[2]:
+            reply = _BROKER_FRAME.pack(_BrokerOp.ERROR, client[2], 0, 0)
+            client[2] = 0
+        else:
+            try:
+                reply = _BROKER_FRAME.pack(
+                    _BrokerOp.VALUES, 0, self._group.get_bits(mask), 0
+                )
+            except OSError as e:
+                reply = _BROKER_FRAME.pack(_BrokerOp.ERROR, e.errno or errno.EIO, 0, 0)
+
+        self._send(fd, reply)
+
+    def _publish(self, line):
+        if line._debouncer is not None:
+            events = line.read_events(64, 0)
+        else:
+            events = line._read_events(64)
+
+        if not events:
+            return
+
+        size = sizeof(gpio_v2_line_event)
+        data = memoryview(events).cast("B")
+        packets = {}
+
+        for fd, (_, subscribed, _) in list(self._clients.items()):
+            if not subscribed:
+                continue
+
+            packet = packets.get(subscribed)
+
+            if packet is None:
+                selected = [
+                    i
+                    for (i, e) in enumerate(events)
+                    if subscribed >> self._bit_offsets[e.offset] & 1
+                ]
+                header = _BROKER_FRAME.pack(_BrokerOp.EVENTS, len(selected), 0, 0)
+                packet = packets[subscribed] = header + b"".join(
+                    data[i * size : (i + 1) * size] for i in selected
+                )
+
+            if len(packet) > _BROKER_FRAME.size and not self._send(
+                fd, packet, socket.MSG_DONTWAIT
+            ):
+                self.dropped += (len(packet) - _BROKER_FRAME.size) // size
+
+
+class RemoteLines:
+    """
+    Client of a Broker, mirroring the Lines API for the lines it serves. Writes are
+    not acknowledged; an error from a write is raised by the next get_bits() or get().
+    """
+
+    def __init__(self, path: str):
+        self._socket = socket.socket(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET | socket.SOCK_CLOEXEC
+        )
+        self._socket.connect(path)
+        self._events: Deque[LineEvent] = deque()
+        self._epoll = select.epoll()
+        self._epoll.register(self._socket.fileno(), select.EPOLLIN)
+        _, num_lines, _, payload = self._reply(_BrokerOp.HELLO)
+        offsets = array("I", payload[: 4 * num_lines])
+        self._bit_offsets = dict((v, i) for (i, v) in enumerate(offsets))
+
+    def fileno(self) -> int:
+        """
+        Get the file descriptor of the connection, e.g. for use with select.
+        Events that arrived with replies may already be queued; see pending().
+        """
+        return self._socket.fileno()
+
+    def close(self):
+        """
+        Disconnect from the broker.
+        """
+        self._epoll.close()
+        self._socket.close()
+
+    def pending(self) -> int:
+        """
+        Get the number of received edge events not yet returned.
+        """
+        return len(self._events)
+
+    def _receive(self, timeout):
+        if not self._epoll.poll(timeout=timeout):
+            return None
+
+        packet = self._socket.recv(_BROKER_PACKET_MAX)
+
+        if not packet:
+            raise ConnectionResetError(errno.ECONNRESET, "broker closed the connection")
+
+        op, arg, a, _ = _BROKER_FRAME.unpack_from(packet)
+
+        if op == _BrokerOp.ERROR:
+            raise OSError(arg, os.strerror(arg))
+
+        if op == _BrokerOp.EVENTS:
+            events = (gpio_v2_line_event * arg).from_buffer_copy(
+                packet, _BROKER_FRAME.size
+            )
+            self._events.extend(Lines._event(e) for e in events)
+
+        return (op, arg, a, packet[_BROKER_FRAME.size :])
+
+    def _reply(self, op):
+        while True:
+            reply = self._receive(None)
+
+            if reply[0] == op:
+                return reply
+
+    def get_bits(self, mask: int) -> int:
+        """
+        Get GPIO line states as a bitmask.
+        """
+        assert 0 <= mask <= U64_MAX, "mask out of range"
+        self._socket.send(_BROKER_FRAME.pack(_BrokerOp.GET, 0, mask, 0))
+        return self._reply(_BrokerOp.VALUES)[2]
+
+    def set_bits(self, bits: int, mask: int):
+        """
+        Set GPIO line states from a bitmask.
+        """
+        assert 0 <= bits <= U64_MAX, "bits out of range"
+        assert 0 <= mask <= U64_MAX, "mask out of range"
+        self._socket.send(_BROKER_FRAME.pack(_BrokerOp.SET, 0, bits, mask))
+
+    def get(self) -> Dict[int, bool]:
+        """
+        Get GPIO line states as a dict of offsets and values.
+        """
+        bits = self.get_bits(U64_MAX)
+        return dict((k, bool(bits & 1 << v)) for (k, v) in self._bit_offsets.items())
+
+    def set(self, values: Dict[int, bool]):
+        """
+        Set GPIO line states from a dict of offsets and values.
+        """
+        bits = 0
+        mask = 0
+
+        for k, v in values.items():
+            offset = int(k)
+            assert offset in self._bit_offsets, f"offset {offset} not served"
+            shift = self._bit_offsets[offset]
+            bits |= bool(v) << shift
+            mask |= 1 << shift
+
+        self.set_bits(bits, mask)
+
+    def subscribe(self, offsets: Optional[Iterable[int]] = None):
+        """
+        Receive edge events of the given lines, by default all, replacing any
+        previous subscription. An empty list unsubscribes.
+        """
+        if offsets is None:
+            offsets = self._bit_offsets
+
+        mask = sum(1 << self._bit_offsets[k] for k in offsets)
+        self._socket.send(_BROKER_FRAME.pack(_BrokerOp.SUBSCRIBE, 0, mask, 0))
+
+    def read_events(
+        self, max_events: int = 16, timeout: Optional[float] = None
+    ) -> Optional[List[LineEvent]]:
+        """
+        Wait for edge events of subscribed lines and get up to max_events of them.
+        """
+        assert 0 < max_events <= U32_MAX, "max_events out of range"
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while not self._events:
+            remaining = None if deadline is None else deadline - time.monotonic()
+
+            if remaining is not None and remaining < 0:
+                return None
+
+            self._receive(remaining)
+
+        n = min(max_events, len(self._events))
+        return [self._events.popleft() for _ in range(n)]
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[LineEvent]:
+        """
+        Wait for the next edge event of subscribed lines.
+        """
+        events = self.read_events(1, timeout)
+        return events[0] if events else None
+
+
+# Mirrors the per-line state kept by the kernel.
+class _SimLine:  # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        "name",
+        "pull",
+        "value",
+        "flags",
+        "debounce_period_us",
+        "consumer",
+        "request",
+        "line_seqno",
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.pull = 0
+        self.value = 0
+        self.flags = GPIO_V2_LINE_FLAG_INPUT
+        self.debounce_period_us = 0
+        self.consumer = ""
+        self.request = None
+        self.line_seqno = 0
+
+    def get(self):
+        """
+        Get the logical value of this line.
+        """
+        if self.flags & GPIO_V2_LINE_FLAG_OUTPUT:
+            return self.value
+
+        return self.pull ^ bool(self.flags & GPIO_V2_LINE_FLAG_ACTIVE_LOW)
+
+
+class _SimRequest:
+    def __init__(self, offsets, fd):
+        self.offsets = offsets
+        self.fd = fd
+        self.seqno = 0
+
+
+class Simulator:
+    """
+    In-process simulation of a GPIO chip, for testing and load testing without gpio-sim.
+    Chips and line requests are backed by pipes, so events are waited for as usual.
+    Inputs are driven with poke() or inject(); edge events can be given a simulated
+    latency by backdating their timestamps.
+    """
+
+    _edges = GPIO_V2_LINE_FLAG_EDGE_RISING | GPIO_V2_LINE_FLAG_EDGE_FALLING
+
+    def __init__(
+        self,
+        num_lines: int = 24,
+        name: str = "gpio-sim",
+        label: str = "gpio-sim",
+        line_names: Optional[List[str]] = None,
+        debounce: bool = True,
+    ):
+        """
+        Without debounce, debounce periods are ignored and not reported in line info,
+        as with chips lacking hardware debounce.
+        """
+        assert 0 < num_lines <= U32_MAX, "num_lines out of range"
+        names = list(line_names or [])
+        names += [""] * (num_lines - len(names))
+        assert len(names) == num_lines, "too many line names"
+        self._name = name
+        self._label = label
+        self._lines = [_SimLine(n) for n in names]
+        self._chips: Dict[int, Tuple[int, set]] = {}
+        self._requests: Dict[int, _SimRequest] = {}
+        self._lock = threading.RLock()
+        self._debounce = debounce
+
+    def chip(self) -> Chip:
+        """
+        Open the simulated chip.
+        """
+        return Chip(self._name, backend=self)
+
+    def poke(self, offset: int, value: int, latency_ns: int = 0):
+        """
+        Drive a line as with a pull-up or pull-down, generating edge events as configured.
+        """
+        with self._lock:
+            line = self._lines[offset]
+            old = line.get()
+            line.pull = int(bool(value))
+            new = line.get()
+
+            if line.request and line.flags & self._edges and old != new:
+                if new and line.flags & GPIO_V2_LINE_FLAG_EDGE_RISING:
+                    self._edge(offset, GPIO_V2_LINE_EVENT_RISING_EDGE, latency_ns)
+                elif not new and line.flags & GPIO_V2_LINE_FLAG_EDGE_FALLING:
+                    self._edge(offset, GPIO_V2_LINE_EVENT_FALLING_EDGE, latency_ns)
+
+    def peek(self, offset: int) -> int:
+        """
+        Get the physical level of a line.
+        """
+        with self._lock:
+            line = self._lines[offset]
+            return line.get() ^ bool(line.flags & GPIO_V2_LINE_FLAG_ACTIVE_LOW)
+
+    def inject(
+        self, offset: int, rate_hz: float, count: int, latency_ns: int = 0
+    ) -> threading.Thread:
+        """
+        Toggle a line count times at the given rate from a background thread.
+        """
+        assert 0 < rate_hz <= 1_000_000_000, "rate_hz out of range"
+
+        def run():
+            timer = _Timer(round(1_000_000_000 / rate_hz))
+
+            try:
+                for _ in range(count):
+                    timer.wait()
+                    self.poke(offset, not self._lines[offset].pull, latency_ns)
+            finally:
+                timer.close()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def _edge(self, offset, event_id, latency_ns):
+        line = self._lines[offset]
+        request = line.request
+        request.seqno += 1
+        line.line_seqno += 1
+
+        if line.flags & GPIO_V2_LINE_FLAG_EVENT_CLOCK_REALTIME:
+            timestamp = time.time_ns()
+        else:
+            timestamp = time.monotonic_ns()
+
+        event = gpio_v2_line_event(
+            timestamp_ns=timestamp - latency_ns,
+            id=event_id,
+            offset=offset,
+            seqno=request.seqno,
+            line_seqno=line.line_seqno,
+        )
+
+        try:
+            os.write(request.fd, event)
+        except BlockingIOError:
+            pass
+
+    def _fill_info(self, li, offset):
+        line = self._lines[offset]
+        memset(addressof(li), 0, sizeof(li))
+        li.name = line.name.encode()
+        li.consumer = line.consumer.encode()
+        li.offset = offset
+        li.flags = line.flags
+
+        if line.request:
+            li.flags |= GPIO_V2_LINE_FLAG_USED
+
+            if line.debounce_period_us:
+                li.num_attrs = 1
+                li.attrs[0].id = GPIO_V2_LINE_ATTR_ID_DEBOUNCE
+                li.attrs[0].u.debounce_period_us = line.debounce_period_us
+
+    def _notify(self, offset, event_type):
+        event = gpio_v2_line_info_changed(
+            timestamp_ns=time.monotonic_ns(), event_type=event_type
+        )
+        self._fill_info(event.info, offset)
+
+        for fd, watched in self._chips.values():
+            if offset in watched:
+                try:
+                    os.write(fd, event)
+                except BlockingIOError:
+                    pass
+
+    @staticmethod
+    def _line_configs(config, num_lines):
+        configs = []
+
+        for i in range(num_lines):
+            flags = config.flags
+            debounce = 0
+            value = 0
+
+            for attr in config.attrs[: config.num_attrs]:
+                if not attr.mask >> i & 1:
+                    continue
+
+                if attr.attr.id == GPIO_V2_LINE_ATTR_ID_FLAGS:
+                    flags = attr.attr.u.flags
+                elif attr.attr.id == GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES:
+                    value = attr.attr.u.values >> i & 1
+                elif attr.attr.id == GPIO_V2_LINE_ATTR_ID_DEBOUNCE:
+                    debounce = attr.attr.u.debounce_period_us
+
+            direction = flags & (GPIO_V2_LINE_FLAG_INPUT | GPIO_V2_LINE_FLAG_OUTPUT)
+
+            if direction == GPIO_V2_LINE_FLAG_INPUT | GPIO_V2_LINE_FLAG_OUTPUT:
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+            if flags & Simulator._edges and direction != GPIO_V2_LINE_FLAG_INPUT:
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+            configs.append((flags, debounce, value))
+
+        return configs
+
+    def _configure(self, offset, flags, debounce, value):
+        line = self._lines[offset]
+
+        if not flags & (GPIO_V2_LINE_FLAG_INPUT | GPIO_V2_LINE_FLAG_OUTPUT):
+            flags |= line.flags & (GPIO_V2_LINE_FLAG_INPUT | GPIO_V2_LINE_FLAG_OUTPUT)
+
+        line.flags = flags
+        line.debounce_period_us = debounce if self._debounce else 0
+
+        if flags & GPIO_V2_LINE_FLAG_OUTPUT:
+            line.value = value
+
+    def _request(self, request):
+        num_lines = request.num_lines
+
+        if not 0 < num_lines <= GPIO_V2_LINES_MAX:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+        offsets = list(request.offsets[:num_lines])
+
+        for offset in offsets:
+            if offset >= len(self._lines):
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+            if self._lines[offset].request:
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+
+        configs = self._line_configs(request.config, num_lines)
+        rfd, wfd = os.pipe()
+        os.set_blocking(wfd, False)
+        size = request.event_buffer_size or num_lines * 16
+
+        try:
+            fcntl(wfd, F_SETPIPE_SZ, size * sizeof(gpio_v2_line_event))
+        except OSError:
+            pass
+
+        sim_request = _SimRequest(offsets, wfd)
+        self._requests[rfd] = sim_request
+        request.fd = rfd
+
+        for offset, config in zip(offsets, configs):
+            line = self._lines[offset]
+            line.request = sim_request
+            line.consumer = request.consumer.decode(errors="replace")
+            line.line_seqno = 0
+            self._configure(offset, *config)
+            self._notify(offset, GPIO_V2_LINE_CHANGED_REQUESTED)
+
+    def _chip_ioctl(self, watched, request, arg):
+        if request == GPIO_GET_CHIPINFO_IOCTL:
+            chip_info = gpiochip_info.from_buffer(arg)
+            chip_info.name = self._name.encode()
+            chip_info.label = self._label.encode()
+            chip_info.lines = len(self._lines)
+        elif request in (GPIO_V2_GET_LINEINFO_IOCTL, GPIO_V2_GET_LINEINFO_WATCH_IOCTL):
+            li = gpio_v2_line_info.from_buffer(arg)
+            offset = li.offset
+
+            if offset >= len(self._lines):
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+            if request == GPIO_V2_GET_LINEINFO_WATCH_IOCTL:
+                if offset in watched:
+                    raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+
+                watched.add(offset)
+
+            self._fill_info(li, offset)
+        elif request == GPIO_GET_LINEINFO_UNWATCH_IOCTL:
+            offset = c_uint32.from_buffer(arg).value
+
+            if offset not in watched:
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+
+            watched.remove(offset)
+        elif request == GPIO_V2_GET_LINE_IOCTL:
+            self._request(gpio_v2_line_request.from_buffer(arg))
+        else:
+            raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+
+    def _line_ioctl(self, sim_request, request, arg):
+        offsets = sim_request.offsets
+
+        if request == GPIO_V2_LINE_GET_VALUES_IOCTL:
+            values = gpio_v2_line_values.from_buffer(arg)
+            mask = values.mask & (1 << len(offsets)) - 1
+            bits = 0
+
+            if not mask:
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+            for i, offset in enumerate(offsets):
+                if mask >> i & 1:
+                    bits |= self._lines[offset].get() << i
+
+            values.bits = bits
+        elif request == GPIO_V2_LINE_SET_VALUES_IOCTL:
+            values = gpio_v2_line_values.from_buffer(arg)
+            mask = values.mask & (1 << len(offsets)) - 1
+
+            if not mask:
+                raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+            lines = [
+                (i, self._lines[offset])
+                for i, offset in enumerate(offsets)
+                if mask >> i & 1
+            ]
+
+            # As in the kernel, nothing is set unless every masked line is an output.
+            for _, line in lines:
+                if not line.flags & GPIO_V2_LINE_FLAG_OUTPUT:
+                    raise OSError(errno.EPERM, os.strerror(errno.EPERM))
+
+            for i, line in lines:
+                line.value = values.bits >> i & 1
+        elif request == GPIO_V2_LINE_SET_CONFIG_IOCTL:
+            config = gpio_v2_line_config.from_buffer(arg)
+            configs = self._line_configs(config, len(offsets))
+
+            for offset, c in zip(offsets, configs):
+                self._configure(offset, *c)
+                self._notify(offset, GPIO_V2_LINE_CHANGED_CONFIG)
+        else:
+            raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+
+    def open(self, path: str) -> int:
+        """
+        Backend interface: open the simulated chip.
+        """
+        assert path == self._name, f"no such chip: {path}"
+        rfd, wfd = os.pipe()
+        os.set_blocking(wfd, False)
+
+        with self._lock:
+            self._chips[rfd] = (wfd, set())
+
+        return rfd
+
+    def ioctl(self, fd: int, request: int, arg) -> int:
+        """
+        Backend interface: perform an ioctl on a simulated chip or line request.
+        """
+        with self._lock:
+            if fd in self._chips:
+                self._chip_ioctl(self._chips[fd][1], request, arg)
+            elif fd in self._requests:
+                self._line_ioctl(self._requests[fd], request, arg)
+            else:
+                raise OSError(errno.EBADF, os.strerror(errno.EBADF))
+
+        return 0
+
+    def release(self, fd: int):
+        """
+        Backend interface: release a simulated chip or line request.
+        """
+        with self._lock:
+            if fd in self._chips:
+                os.close(self._chips.pop(fd)[0])
+            elif fd in self._requests:
+                sim_request = self._requests.pop(fd)
+                os.close(sim_request.fd)
+
+                for offset in sim_request.offsets:
+                    line = self._lines[offset]
+                    line.request = None
+                    line.consumer = ""
+                    line.flags &= GPIO_V2_LINE_FLAG_INPUT | GPIO_V2_LINE_FLAG_OUTPUT
+                    line.debounce_period_us = 0
+                    self._notify(offset, GPIO_V2_LINE_CHANGED_RELEASED)
+
+
+def chip(path: str) -> Chip:
+    """
+    Public constructor.
+    """
     return Chip(path)
+
+
+def _main(argv=None):
+    import argparse  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(
+        prog="python -m gpio",
+        description="Serve GPIO lines to other processes over a Unix domain socket.",
+    )
+    parser.add_argument("socket", help="path of the socket to create")
+    parser.add_argument("--chip", default="/dev/gpiochip0")
+    parser.add_argument("--consumer", default="gpio-broker")
+    parser.add_argument("--output", type=int, nargs="*", default=[], metavar="OFFSET")
+    parser.add_argument("--input", type=int, nargs="*", default=[], metavar="OFFSET")
+    parser.add_argument(
+        "--edges", choices=["rising", "falling", "both", "none"], default="both"
+    )
+    parser.add_argument("--debounce-us", type=int, default=0)
+    parser.add_argument("--event-buffer-size", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    c = chip(args.chip)
+    lines = []
+
+    if args.output:
+        lines.append(c.request(args.output, consumer=args.consumer, flags=["OUTPUT"]))
+
+    if args.input:
+        flags = ["INPUT"] + {
+            "rising": ["EDGE_RISING"],
+            "falling": ["EDGE_FALLING"],
+            "both": ["EDGE_RISING", "EDGE_FALLING"],
+            "none": [],
+        }[args.edges]
+        attrs = []
+
+        if args.debounce_us:
+            mask = (1 << len(args.input)) - 1
+            attrs.append({"debounce_period_us": args.debounce_us, "mask": mask})
+
+        lines.append(
+            c.request(
+                args.input,
+                consumer=args.consumer,
+                flags=flags,
+                attrs=attrs,
+                event_buffer_size=args.event_buffer_size,
+            )
+        )
+
+    if not lines:
+        parser.error("no lines given")
+
+    with Broker(args.socket, lines) as broker:
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,126 @@
+"""
+Benchmarks for the ioctl and event paths against gpio-sim.
+
+Usage: PYTHONPATH=../src python bench.py [--calls N] [--output FILE]
+
+Results are written as JSON, one entry per benchmark, for comparison between releases.
+"""
+
+import argparse
+import json
+import platform
+import threading
+import time
+
+import gpio
+from conftest import CHIP_PATH, GpioSim
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    n = len(samples)
+
+    return dict(
+        (f"p{p}_ns", samples[min(n - 1, n * p // 100)]) for p in (50, 90, 99)
+    ) | {"max_ns": samples[-1]}
+
+
+def bench_calls(func, calls):
+    samples = [0] * calls
+    clock = time.perf_counter_ns
+
+    for i in range(calls):
+        start = clock()
+        func()
+        samples[i] = clock() - start
+
+    total = sum(samples)
+    return {"calls": calls, "calls_per_s": calls * 1e9 / total} | percentiles(samples)
+
+
+def bench_events(line, sim, offset, events):
+    def toggle():
+        for i in range(events):
+            sim.poke(offset, (i + 1) % 2)
+
+    latencies = []
+    thread = threading.Thread(target=toggle)
+    start = time.monotonic_ns()
+    thread.start()
+
+    while len(latencies) < events:
+        batch = line.read_events(64, 1)
+
+        if batch is None:
+            break
+
+        now = time.monotonic_ns()
+        latencies.extend(now - e.timestamp_ns for e in batch)
+
+    elapsed = time.monotonic_ns() - start
+    thread.join()
+
+    return {
+        "events": len(latencies),
+        "lost": events - len(latencies),
+        "events_per_s": len(latencies) * 1e9 / elapsed,
+    } | percentiles(latencies or [0])
+
+
+def bench_wait(line, sim, offset, events):
+    latencies = []
+
+    for i in range(events):
+        sim.poke(offset, (i + 1) % 2)
+        event = line.wait(1)
+        assert event is not None, "event lost"
+        latencies.append(time.monotonic_ns() - event.timestamp_ns)
+
+    return {"events": events} | percentiles(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--output", default="-")
+    args = parser.parse_args()
+
+    sim = GpioSim()
+    chip = gpio.chip(CHIP_PATH)
+    results = {
+        "version": gpio.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "kernel": platform.release(),
+    }
+
+    out = chip.request([4, 5, 6, 7], consumer="bench", flags=["OUTPUT"])
+    values = {4: True, 5: False, 6: True, 7: False}
+    fast = out.fast()
+    results["Lines.set"] = bench_calls(lambda: out.set(values), args.calls)
+    results["Lines.get"] = bench_calls(out.get, args.calls)
+    results["Lines.set_bits"] = bench_calls(lambda: out.set_bits(5, 15), args.calls)
+    results["Lines.get_bits"] = bench_calls(lambda: out.get_bits(15), args.calls)
+    results["FastLines.set_bits"] = bench_calls(
+        lambda: fast.set_bits(5, 15), args.calls
+    )
+    results["FastLines.get_bits"] = bench_calls(lambda: fast.get_bits(15), args.calls)
+    results["Chip.info"] = bench_calls(chip.info, max(1, args.calls // 100))
+
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    inp = chip.request([14], consumer="bench", flags=flags, event_buffer_size=1024)
+    results["Lines.wait"] = bench_wait(inp, sim, 14, args.events)
+    results["Lines.read_events"] = bench_events(inp, sim, 14, args.events)
+
+    text = json.dumps(results, indent=2)
+
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import subprocess
 
 import pytest
 
+import gpio
+
 CHIP_PATH = "/dev/gpiochip0"
 SIM_PATH = "/sys/devices/platform/gpio-sim.0/gpiochip0"
 
@@ -37,3 +39,8 @@ def gpiosim():
 def c_data():
     subprocess.run("make")
     return json.load(open("data.json", "rb"))
+
+
+@pytest.fixture
+def sim():
+    return gpio.Simulator(24, name="gpiochip0", label="gpiochip0")
@@ -1,5 +1,10 @@
+import asyncio
 import json
+import threading
 import time
+
+import pytest
+
 import gpio
 
 
@@ -113,18 +118,18 @@ def test_wait_line_event(chip_path, gpiosim):
     gpiosim.poke(14, 0)
 
     event = line.wait(1)
-    assert event["timestamp_ns"]
-    assert event["id"] == "RISING_EDGE"
-    assert event["offset"] == 14
-    assert event["seqno"] == 1
-    assert event["line_seqno"] == 1
+    assert event.timestamp_ns
+    assert event.id == gpio.LineEventId.RISING_EDGE
+    assert event.offset == 14
+    assert event.seqno == 1
+    assert event.line_seqno == 1
 
     event = line.wait(1)
-    assert event["timestamp_ns"]
-    assert event["id"] == "FALLING_EDGE"
-    assert event["offset"] == 14
-    assert event["seqno"] == 2
-    assert event["line_seqno"] == 2
+    assert event.timestamp_ns
+    assert event.id == gpio.LineEventId.FALLING_EDGE
+    assert event.offset == 14
+    assert event.seqno == 2
+    assert event.line_seqno == 2
 
 
 def test_wait_line_info_changed(chip_path):
@@ -134,19 +139,19 @@ def test_wait_line_info_changed(chip_path):
     def req():
         line = chip.request([7], consumer="test10", flags=["INPUT"])
         event = chip.wait(1)
-        assert event["timestamp_ns"]
-        assert event["event_type"] == "LINE_REQUESTED"
-        assert event["info"]["consumer"] == "test10"
-        assert event["info"]["offset"] == 7
-        assert event["info"]["flags"] == ["USED", "INPUT"]
+        assert event.timestamp_ns
+        assert event.event_type == gpio.LineChangedType.LINE_REQUESTED
+        assert event.info["consumer"] == "test10"
+        assert event.info["offset"] == 7
+        assert event.info["flags"] == ["USED", "INPUT"]
 
     req()
     event = chip.wait(1)
-    assert event["timestamp_ns"]
-    assert event["event_type"] == "LINE_RELEASED"
-    assert event["info"]["consumer"] == ""
-    assert event["info"]["offset"] == 7
-    assert event["info"]["flags"] == ["INPUT"]
+    assert event.timestamp_ns
+    assert event.event_type == gpio.LineChangedType.LINE_RELEASED
+    assert event.info["consumer"] == ""
+    assert event.info["offset"] == 7
+    assert event.info["flags"] == ["INPUT"]
 
     chip.unwatch(7)
     assert chip.wait(1) == None
@@ -165,11 +170,11 @@ def test_wait_config_changed(chip_path):
     line.set_config(flags=flags, attrs=attrs)
 
     event = chip.wait(0.1)
-    assert event["timestamp_ns"]
-    assert event["event_type"] == "CONFIG_CHANGED"
-    assert event["info"]["consumer"] == "a"
-    assert event["info"]["offset"] == 16
-    assert event["info"]["flags"] == [
+    assert event.timestamp_ns
+    assert event.event_type == gpio.LineChangedType.CONFIG_CHANGED
+    assert event.info["consumer"] == "a"
+    assert event.info["offset"] == 16
+    assert event.info["flags"] == [
         "USED",
         "INPUT",
         "BIAS_PULL_UP",
@@ -177,3 +182,453 @@ def test_wait_config_changed(chip_path):
 
     chip.unwatch(16)
     assert chip.wait(0.1) == None
+
+
+def test_read_events(chip_path, gpiosim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = gpio.chip(chip_path)
+    line = chip.request([14, 15], flags=flags)
+    gpiosim.poke(14, 1)
+    gpiosim.poke(15, 1)
+    gpiosim.poke(14, 0)
+    time.sleep(0.1)
+
+    events = line.read_events(2, 1)
+    assert len(events) == 2
+    assert events[0].id == gpio.GPIO_V2_LINE_EVENT_RISING_EDGE
+    assert events[0].offset == 14
+    assert events[0].seqno == 1
+    assert events[1].offset == 15
+    assert events[1].seqno == 2
+
+    events = line.read_events(16, 1)
+    assert len(events) == 1
+    assert events[0].id == gpio.GPIO_V2_LINE_EVENT_FALLING_EDGE
+    assert events[0].line_seqno == 2
+    assert line.read_events(16, 0.1) == None
+
+
+def test_wait_async_line_event(chip_path, gpiosim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = gpio.chip(chip_path)
+    line = chip.request([14, 15], flags=flags)
+
+    async def wait():
+        assert await line.wait_async(0.1) == None
+        gpiosim.poke(15, 1)
+        gpiosim.poke(15, 0)
+        event = await line.wait_async(1)
+        assert event.id == gpio.LineEventId.RISING_EDGE
+        assert event.offset == 15
+
+        async for event in line.events():
+            assert event.id == gpio.LineEventId.FALLING_EDGE
+            assert event.seqno == 2
+            break
+
+    asyncio.run(wait())
+
+
+def test_wait_async_line_info_changed(chip_path):
+    chip = gpio.chip(chip_path)
+    chip.watch(17)
+
+    async def wait():
+        line = chip.request([17], consumer="async")
+        event = await chip.wait_async(1)
+        assert event.event_type == gpio.LineChangedType.LINE_REQUESTED
+        assert event.info["consumer"] == "async"
+        assert await chip.wait_async(0.1) == None
+
+    asyncio.run(wait())
+    chip.unwatch(17)
+
+
+def test_selector(chip_path, gpiosim):
+    flags = ["INPUT", "EDGE_RISING"]
+    chip = gpio.chip(chip_path)
+    chip.watch(20)
+    line_a = chip.request([18], flags=flags)
+    line_b = chip.request([19], flags=flags)
+    events = []
+
+    sel = gpio.Selector()
+    sel.register(line_a, events.append)
+    sel.register(line_b, events.append)
+    sel.register(chip, events.append)
+    assert sel.select(0.1) == []
+
+    gpiosim.poke(19, 1)
+    assert sel.select(1) == [line_b]
+    assert sel.dispatch(1) == 1
+    assert events[0].offset == 19
+
+    line_c = chip.request([20])
+    assert sel.dispatch(1) == 1
+    assert events[1].event_type == gpio.LineChangedType.LINE_REQUESTED
+
+    sel.close()
+    chip.unwatch(20)
+
+
+def test_capture(chip_path, gpiosim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = gpio.chip(chip_path)
+    line = chip.request([21], flags=flags, event_buffer_size=32)
+
+    with gpio.Capture(line, capacity=4) as capture:
+        for i in range(6):
+            gpiosim.poke(21, (i + 1) % 2)
+
+        time.sleep(0.1)
+        assert len(capture) == 4
+        assert capture.dropped == 0
+        assert capture.overruns == 2
+
+        events = capture.read(3, 1)
+        assert [e.seqno for e in events] == [1, 2, 3]
+        assert events[0].id == gpio.GPIO_V2_LINE_EVENT_RISING_EDGE
+
+    events = capture.read(16, 0)
+    assert [e.seqno for e in events] == [4]
+    assert capture.read(16, 0.1) == None
+
+
+def test_event_as_dict(chip_path, gpiosim):
+    chip = gpio.chip(chip_path)
+    chip.watch(22)
+    line = chip.request([22], consumer="dict", flags=["INPUT", "EDGE_RISING"])
+    gpiosim.poke(22, 1)
+
+    event = line.wait(1).as_dict()
+    assert event["id"] == "RISING_EDGE"
+    assert event["offset"] == 22
+    assert event["seqno"] == 1
+
+    event = chip.wait(1).as_dict()
+    assert event["event_type"] == "LINE_REQUESTED"
+    assert event["info"]["consumer"] == "dict"
+    assert event["info"]["offset"] == 22
+    chip.unwatch(22)
+
+
+def test_compiled_line_map(chip_path, gpiosim):
+    chip = gpio.chip(chip_path)
+    line = chip.request([4, 5, 6, 7], flags=["OUTPUT"])
+    pins = line.compile([7, 5])
+
+    pins.set([True, False])
+    assert pins.get() == {7: True, 5: False}
+    assert pins.read() == 0b01
+    assert gpiosim.peek(7) == 1
+    assert gpiosim.peek(5) == 0
+
+    pins.write(0b10)
+    assert pins.read() == 0b10
+    assert line.get() == {4: False, 5: True, 6: False, 7: False}
+
+
+def test_output_shadow(chip_path, gpiosim):
+    attrs = [{"values": 0b10, "mask": 0b11}]
+    chip = gpio.chip(chip_path)
+    line = chip.request([4, 5], flags=["OUTPUT"], attrs=attrs, shadow=True)
+    assert line.get_outputs() == 0b10
+    assert gpiosim.peek(5) == 1
+
+    line.toggle(0b11)
+    assert line.get_outputs() == 0b01
+    assert gpiosim.peek(4) == 1
+    assert gpiosim.peek(5) == 0
+
+    line.update(0b11, 0b10)
+    assert line.get_outputs() == 0b11
+    assert line.get_bits(0b11) == 0b11
+
+    line.set({4: False})
+    assert line.get_outputs() == 0b10
+
+
+def test_batch(chip_path, gpiosim):
+    chip = gpio.chip(chip_path)
+    line = chip.request([4, 5, 6], flags=["OUTPUT"])
+
+    with line.batch():
+        line.set({4: True, 5: True})
+
+        with line.batch():
+            line.set_bits(0b100, 0b110)
+
+        assert gpiosim.peek(4) == 0
+        assert gpiosim.peek(6) == 0
+
+    assert line.get() == {4: True, 5: False, 6: True}
+
+    with line.batch():
+        line.set_bits(0b000, 0b001)
+        line.flush()
+        assert gpiosim.peek(4) == 0
+
+    with pytest.raises(ValueError):
+        with line.batch():
+            line.set_bits(0b110, 0b110)
+            raise ValueError()
+
+    assert line.get() == {4: False, 5: False, 6: True}
+
+
+def test_play(chip_path, gpiosim):
+    chip = gpio.chip(chip_path)
+    line = chip.request([4, 5], flags=["OUTPUT"])
+    sequence = [(0b01, 0b11), (0b10, 0b11), (0b11, 0b11)]
+
+    player = line.play(sequence, 10_000_000)
+    report = player.join(1)
+    assert report["steps"] == 3
+    assert report["period_ns"] == 10_000_000
+    assert report["elapsed_ns"] >= 30_000_000
+    assert report["missed"] >= 0
+    assert gpiosim.peek(4) == 1
+    assert gpiosim.peek(5) == 1
+
+
+def test_sampler(chip_path, gpiosim):
+    chip = gpio.chip(chip_path)
+    line = chip.request([14, 15])
+    chunks = []
+
+    def callback(timestamps, values):
+        chunks.append((list(timestamps), list(values)))
+
+    with gpio.Sampler(line, callback, 1000, mask=0b11, compress=True) as sampler:
+        time.sleep(0.1)
+        gpiosim.poke(15, 1)
+        time.sleep(0.1)
+
+    gpiosim.poke(15, 0)
+    assert sampler.samples > 100
+    assert len(chunks) == 1
+    timestamps, values = chunks[0]
+    assert values == [0b00, 0b10]
+    assert timestamps[0] < timestamps[1]
+
+
+def test_selective_info(chip_path):
+    chip = gpio.chip(chip_path)
+    line = chip.request([3], consumer="sel")
+    info = chip.info(offsets=[3, 1], fields=["offset", "consumer"])
+    assert info["name"] == "gpiochip0"
+    assert info["lines"] == [
+        {"offset": 3, "consumer": "sel"},
+        {"offset": 1, "consumer": ""},
+    ]
+
+
+def test_cached_info(chip_path):
+    chip = gpio.chip(chip_path)
+    chip.cache()
+    assert len(chip.info()["lines"]) == 24
+    assert chip.info(offsets=[8])["lines"][0]["consumer"] == ""
+
+    line = chip.request([8], consumer="cached")
+    assert chip.info(offsets=[8])["lines"][0]["consumer"] == "cached"
+    assert chip.wait(0) == None
+
+    chip.watch(8)
+    chip.unwatch(8)
+    line.close()
+    assert chip.info(offsets=[8], fields=["consumer"])["lines"] == [{"consumer": ""}]
+    assert chip.refresh() == []
+
+
+def test_find_line(chip_path):
+    chip = gpio.chip(chip_path)
+    names = [li["name"] for li in chip.info()["lines"] if li["name"]]
+    assert gpio.find_line("no such line") == None
+    assert chip.find_line("no such line") == None
+
+    if not names:
+        pytest.skip("gpio-sim lines have no names")
+
+    offset = chip.find_line(names[0])
+    assert gpio.find_line(names[0]) == (chip_path, offset)
+    line = chip.request_by_name([names[0]], consumer="by name")
+    assert chip.info(offsets=[offset])["lines"][0]["consumer"] == "by name"
+
+
+def test_line_group(chip_path, gpiosim):
+    chip = gpio.chip(chip_path)
+    group = gpio.request_group([(chip, [4, 5]), (chip, [6, 7])], flags=["OUTPUT"])
+    assert len(group) == 4
+
+    group.set_bits(0b1001, 0b1111)
+    assert group.get_bits(0b1111) == 0b1001
+    assert gpiosim.peek(4) == 1
+    assert gpiosim.peek(5) == 0
+    assert gpiosim.peek(6) == 0
+    assert gpiosim.peek(7) == 1
+
+    group.set_bits(0b0110, 0b0110)
+    assert group.get_bits(0b1111) == 0b1111
+    group.close()
+
+    empty = gpio.LineGroup([], threads=True)
+    assert len(empty) == 0
+    empty.close()
+
+
+def test_port(chip_path, gpiosim):
+    chip = gpio.chip(chip_path)
+    line = chip.request([4, 5, 6, 7], flags=["OUTPUT"])
+    port = line.port([6, 4, 7, 5])
+    assert port._table is None
+
+    port.write(0b0110)
+    assert port.read() == 0b0110
+    assert line.get() == {4: True, 5: False, 6: False, 7: True}
+
+    port.write_many(bytes([0b0001, 0b1000, 0b1111]))
+    assert port.read() == 0b1111
+    assert gpiosim.peek(5) == 1
+
+
+def test_spi(chip_path, gpiosim):
+    attrs = [{"flags": ["INPUT"], "mask": 0b1000}]
+    chip = gpio.chip(chip_path)
+    line = chip.request([4, 5, 6, 14], flags=["OUTPUT"], attrs=attrs)
+    spi = gpio.Spi(line, clock=4, mosi=5, miso=14, cs=6)
+    assert len(spi.frames(b"\xa5")) == 18
+
+    spi.write(b"\xa5\x01")
+    assert spi.bit_rate > 0
+    assert gpiosim.peek(4) == 0
+    assert gpiosim.peek(5) == 0
+    assert gpiosim.peek(6) == 1
+
+    gpiosim.poke(14, 1)
+    assert spi.transfer(b"\x00\x00") == b"\xff\xff"
+    assert gpiosim.peek(5) == 0
+
+
+def test_fast(chip_path, gpiosim):
+    chip = gpio.chip(chip_path)
+    line = chip.request([4, 5], flags=["OUTPUT"])
+    fast = line.fast()
+
+    fast.set_bits(0b10, 0b11)
+    assert fast.get_bits(0b11) == 0b10
+    assert gpiosim.peek(4) == 0
+    assert gpiosim.peek(5) == 1
+
+
+def test_metrics(chip_path, gpiosim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = gpio.chip(chip_path)
+    line = chip.request([14], flags=flags)
+    metrics = line.instrument()
+
+    gpiosim.poke(14, 1)
+    assert line.wait(1).seqno == 1
+    assert line.get_bits(1) == 1
+
+    snapshot = metrics.snapshot()
+    assert snapshot["timings"]["GPIO_V2_LINE_GET_VALUES"]["count"] == 1
+    assert snapshot["timings"]["wait"]["count"] == 1
+    assert snapshot["events"] == 1
+    assert snapshot["dropped"] == 0
+
+
+def test_latency_profiler(chip_path, gpiosim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING", "EVENT_CLOCK_REALTIME"]
+    chip = gpio.chip(chip_path)
+    line = chip.request([14], flags=flags)
+    profiler = line.profile()
+    assert profiler.realtime == {14}
+
+    gpiosim.poke(14, 1)
+    assert line.wait(1) is not None
+
+    snapshot = profiler.snapshot()
+    assert snapshot[14]["count"] == 1
+    assert 0 < snapshot[14]["p50_ns"] < 1_000_000_000
+
+
+def test_record_replay(chip_path, gpiosim, tmp_path):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = gpio.chip(chip_path)
+    line = chip.request([14], flags=flags)
+    path = str(tmp_path / "events.bin")
+
+    with gpio.Recorder(path, offsets=[14], chip_name=chip.info()["name"]) as recorder:
+        gpiosim.poke(14, 1)
+        recorder.write(line.wait(1))
+        gpiosim.poke(14, 0)
+        recorder.write(line.read_events(16, 1))
+
+    recording = gpio.Recording(path)
+    assert recording.offsets == [14]
+    assert [e.id for e in recording.events] == [1, 2]
+
+    out = chip.request([4], flags=["OUTPUT"])
+    assert recording.replay(out, offsets={14: 4}).join(1)["steps"] == 2
+    assert gpiosim.peek(4) == 0
+    recording.close()
+
+
+def test_quadrature_decoder(chip_path, gpiosim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = gpio.chip(chip_path)
+    line = chip.request([14, 15], flags=flags)
+
+    with gpio.QuadratureDecoder(line, 14, 15) as decoder:
+        for offset, value in [(14, 1), (15, 1), (14, 0), (15, 0)] * 2:
+            gpiosim.poke(offset, value)
+
+        time.sleep(0.1)
+
+    assert decoder.snapshot()["position"] == 8
+
+
+def test_software_debounce(chip_path, gpiosim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = gpio.chip(chip_path)
+    line = chip.request([14], flags=flags)
+    line.debounce(10000)
+
+    for value in (1, 0, 1):
+        gpiosim.poke(14, value)
+
+    event = line.wait(1)
+    assert event.id == gpio.LineEventId.RISING_EDGE
+    assert event.seqno == 3
+    assert line.wait(0.05) is None
+
+
+def test_broker(chip_path, gpiosim, tmp_path):
+    chip = gpio.chip(chip_path)
+    out = chip.request([4], flags=["OUTPUT"])
+    inp = chip.request([14], flags=["INPUT", "EDGE_RISING", "EDGE_FALLING"])
+    path = str(tmp_path / "gpio.sock")
+
+    with gpio.Broker(path, [out, inp]) as broker:
+        stop = threading.Event()
+
+        def serve():
+            while not stop.is_set():
+                broker.serve(0.01)
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+
+        try:
+            client = gpio.RemoteLines(path)
+            client.subscribe()
+            client.set({4: True})
+            assert client.get()[4] == True
+            assert gpiosim.peek(4) == 1
+
+            gpiosim.poke(14, 1)
+            assert client.wait(1).offset == 14
+            client.close()
+        finally:
+            stop.set()
+            thread.join()
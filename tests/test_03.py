@@ -0,0 +1,630 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import gpio
+
+
+def test_sim_chip_info(sim):
+    chip = sim.chip()
+    info = chip.info()
+    assert info["name"] == "gpiochip0"
+    assert len(info["lines"]) == 24
+    assert info["lines"][0]["flags"] == ["INPUT"]
+
+
+def test_sim_line_request_w_flags(sim):
+    flags = ["ACTIVE_LOW", "OUTPUT", "OPEN_DRAIN"]
+    chip = sim.chip()
+    line = chip.request([2, 3], consumer="sim", flags=flags)
+    info = chip.info()
+    assert info["lines"][1]["flags"] == ["INPUT"]
+    assert info["lines"][2]["flags"] == ["USED"] + flags
+    assert info["lines"][3]["consumer"] == "sim"
+
+    with pytest.raises(OSError):
+        chip.request([3])
+
+    line.close()
+    assert chip.info()["lines"][3]["consumer"] == ""
+
+
+def test_sim_get_set(sim):
+    chip = sim.chip()
+    attrs = [{"flags": ["INPUT"], "mask": 0b100}, {"values": 0b10, "mask": 0b10}]
+    line = chip.request([4, 5, 6], flags=["OUTPUT"], attrs=attrs)
+    assert sim.peek(5) == 1
+
+    line.set({4: True, 5: False})
+    assert line.get() == {4: True, 5: False, 6: False}
+    assert sim.peek(4) == 1
+
+    sim.poke(6, 1)
+    assert line.get_bits(0b100) == 0b100
+    assert line.fast().get_bits(0b111) == 0b101
+
+    with pytest.raises(OSError):
+        line.set({6: False})
+
+    with pytest.raises(OSError):
+        line.set({4: False, 6: False})
+
+    assert sim.peek(4) == 1
+
+
+def test_sim_wait_line_event(sim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = sim.chip()
+    line = chip.request([14, 15], flags=flags)
+    assert line.wait(0.01) == None
+
+    sim.poke(14, 1, latency_ns=1_000_000)
+    sim.poke(14, 0)
+    event = line.wait(1)
+    assert event.id == gpio.LineEventId.RISING_EDGE
+    assert event.offset == 14
+    assert event.seqno == 1
+    assert event.line_seqno == 1
+    assert time.monotonic_ns() - event.timestamp_ns >= 1_000_000
+
+    event = line.wait(1)
+    assert event.id == gpio.LineEventId.FALLING_EDGE
+    assert event.seqno == 2
+
+
+def test_sim_wait_line_info_changed(sim):
+    chip = sim.chip()
+    chip.watch(7)
+    line = chip.request([7], consumer="test10", flags=["INPUT"])
+
+    event = chip.wait(1)
+    assert event.event_type == gpio.LineChangedType.LINE_REQUESTED
+    assert event.info["consumer"] == "test10"
+    assert event.info["flags"] == ["USED", "INPUT"]
+
+    line.set_config(flags=["INPUT", "BIAS_PULL_UP"])
+    event = chip.wait(1)
+    assert event.event_type == gpio.LineChangedType.CONFIG_CHANGED
+    assert event.info["flags"] == ["USED", "INPUT", "BIAS_PULL_UP"]
+
+    del line
+    event = chip.wait(1)
+    assert event.event_type == gpio.LineChangedType.LINE_RELEASED
+    assert event.info["flags"] == ["INPUT"]
+
+    chip.unwatch(7)
+    line = chip.request([7])
+    assert chip.wait(0.01) == None
+
+
+def test_sim_inject(sim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = sim.chip()
+    line = chip.request([9], flags=flags, event_buffer_size=256)
+
+    with gpio.Capture(line, capacity=256) as capture:
+        sim.inject(9, 10000, 100).join()
+        time.sleep(0.05)
+
+    events = capture.read(256, 0)
+    assert len(events) == 100
+    assert capture.dropped == 0
+    assert [e.seqno for e in events] == list(range(1, 101))
+
+
+def test_sim_async(sim):
+    flags = ["INPUT", "EDGE_RISING"]
+    chip = sim.chip()
+    line = chip.request([1], flags=flags)
+
+    async def wait():
+        asyncio.get_running_loop().call_later(0.01, sim.poke, 1, 1)
+        event = await line.wait_async(1)
+        assert event.offset == 1
+
+    asyncio.run(wait())
+    # Readiness is checked without an epoll instance of the line's own.
+    assert line._epoll is None
+
+
+def test_sim_metrics(sim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = sim.chip()
+    metrics = chip.instrument()
+    samples = []
+    metrics.add_hook(lambda key, value: samples.append(key))
+    line = chip.request([14], flags=flags, event_buffer_size=16)
+
+    for i in range(300):
+        sim.poke(14, (i + 1) % 2)
+
+    assert line.wait(1).seqno == 1
+    events = 1
+
+    while True:
+        batch = line.read_events(64, 0.01)
+
+        if batch is None:
+            break
+
+        events += len(batch)
+
+    sim.poke(14, 1)
+    assert line.read_events(64, 1)[0].seqno == 301
+    events += 1
+    line.get_bits(1)
+    snapshot = metrics.snapshot()
+    timings = snapshot["timings"]
+    assert timings["GPIO_V2_GET_LINE"]["count"] == 1
+    assert timings["GPIO_V2_LINE_GET_VALUES"]["count"] == 1
+    assert timings["wait"]["count"] == 1
+    assert timings["read_events"]["max_ns"] >= timings["read_events"]["mean_ns"]
+    assert snapshot["events"] == events
+    assert snapshot["dropped"] == 301 - events > 0
+    assert snapshot["max_batch"] <= 64
+    assert samples.count("dropped") >= 1
+
+    metrics.reset()
+    line.uninstrument()
+    line.get_bits(1)
+    assert metrics.snapshot()["timings"] == {}
+
+
+def test_latency_histogram():
+    histogram = gpio.LatencyHistogram(precision=5)
+
+    for ns in range(1, 100001):
+        histogram.record(ns)
+
+    histogram.record(-5)
+    assert histogram.count == 100001
+    assert histogram.min_ns == 0
+    assert histogram.max_ns == 100000
+
+    for p in (50, 90, 99):
+        assert abs(histogram.percentile(p) - p * 1000) <= p * 1000 / 32
+
+    assert histogram.percentile(100) == 100000
+
+    other = gpio.LatencyHistogram(precision=5)
+    other.record(10**9)
+    histogram.merge(other)
+    assert histogram.snapshot()["max_ns"] == 10**9
+
+
+def test_sim_latency_profiler(sim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    attrs = [{"flags": flags + ["EVENT_CLOCK_REALTIME"], "mask": 0b10}]
+    chip = sim.chip()
+    line = chip.request([14, 15], flags=flags, attrs=attrs)
+    profiler = line.profile()
+    assert profiler.realtime == {15}
+
+    for i in range(10):
+        sim.poke(14, (i + 1) % 2, latency_ns=2_000_000)
+        sim.poke(15, (i + 1) % 2, latency_ns=1_000_000)
+
+    assert line.wait(1).offset == 14
+    assert len(line.read_events(64, 1)) == 19
+
+    snapshot = profiler.snapshot()
+    assert list(snapshot) == [14, 15]
+    assert snapshot[14]["count"] == snapshot[15]["count"] == 10
+    assert snapshot[14]["min_ns"] >= 2_000_000
+    assert snapshot[15]["min_ns"] >= 1_000_000
+    assert snapshot[15]["max_ns"] < snapshot[14]["max_ns"]
+    assert profiler.total().count == 20
+
+    line.set_config(flags=flags)
+    assert profiler.realtime == set()
+    line.unprofile()
+
+
+def test_sim_record_replay(sim, tmp_path):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = sim.chip()
+    line = chip.request([14], flags=flags)
+    path = str(tmp_path / "events.bin")
+
+    with gpio.Recorder(path, offsets=[14], chip_name="gpiochip0") as recorder:
+        for i in range(4):
+            sim.poke(14, (i + 1) % 2)
+            time.sleep(0.01)
+
+        recorder.write(line.wait(1))
+        recorder.write(line.read_events(64, 1))
+        assert recorder.count == 4
+
+    with open(path, "ab") as f:
+        f.write(b"\0" * 10)
+
+    recording = gpio.Recording(path)
+    assert recording.chip == "gpiochip0"
+    assert recording.offsets == [14]
+    assert len(recording) == 4
+    assert [e.seqno for e in recording.events] == [1, 2, 3, 4]
+    assert recording.events[0].id == gpio.LineEventId.RISING_EDGE
+
+    out = chip.request([4], flags=["OUTPUT"])
+    replay = recording.replay(out, offsets={14: 4})
+    report = replay.join(1)
+    assert report["steps"] == 4
+    assert report["elapsed_ns"] >= 30_000_000
+    assert sim.peek(4) == 0
+
+    recording.close()
+
+
+def test_sim_recording_array(sim, tmp_path):
+    numpy = pytest.importorskip("numpy")
+    path = str(tmp_path / "events.bin")
+
+    with gpio.Recorder(path) as recorder:
+        recorder.write(
+            [gpio.LineEvent(1000, 1, 3, 1, 1), gpio.LineEvent(2000, 2, 3, 2, 2)]
+        )
+
+    recording = gpio.Recording(path)
+    array = recording.array()
+    assert array["timestamp_ns"].tolist() == [1000, 2000]
+    assert array["id"].tolist() == [1, 2]
+    assert numpy.all(array["offset"] == 3)
+    del array
+    recording.close()
+
+
+def test_pulse_stats():
+    numpy = pytest.importorskip("numpy")
+    events = []
+
+    for i in range(4):
+        start = 1_000_000 + i * 1000
+        events.append(gpio.LineEvent(start, 1, 3, 2 * i + 1, 2 * i + 1))
+        events.append(gpio.LineEvent(start + 250, 2, 3, 2 * i + 2, 2 * i + 2))
+
+    events.append(gpio.LineEvent(1_000_500, 1, 5, 9, 1))
+    edges = gpio.line_edges(events)
+    assert list(edges) == [3, 5]
+    assert edges[5][1].tolist() == [True]
+
+    stats = gpio.edge_stats(events)[3]
+    assert stats["high_ns"].tolist() == [250] * 4
+    assert stats["low_ns"].tolist() == [750] * 3
+    assert stats["period_ns"].tolist() == [1000] * 3
+    assert numpy.allclose(stats["duty_cycle"], 0.25)
+
+
+def test_sim_event_array(sim):
+    pytest.importorskip("numpy")
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = sim.chip()
+    line = chip.request([14, 15], flags=flags)
+
+    for i in range(6):
+        sim.poke(14 + i % 2, 1 - i // 2 % 2)
+
+    batch = line.read_events(64, 1)
+    array = gpio.event_array(batch)
+    assert array["seqno"].tolist() == list(range(1, 7))
+    assert array["offset"].tolist() == [14, 15] * 3
+    assert gpio.event_array(line._event(batch[0]))["seqno"].tolist() == [1]
+
+
+def test_sim_sample_levels(sim):
+    pytest.importorskip("numpy")
+    chip = sim.chip()
+    line = chip.request([4, 5, 6], flags=["OUTPUT"])
+    samples = []
+
+    for bits in (0b000, 0b101, 0b010):
+        line.set_bits(bits, 0b111)
+        samples.append(line.get_bits(0b111))
+
+    levels = gpio.sample_levels(samples, line)
+    assert levels.shape == (3, 3)
+    assert levels[1].tolist() == [True, False, True]
+    assert levels[2].tolist() == list(line.get().values())
+    assert gpio.sample_levels(samples, line, [6, 4])[1].tolist() == [True, True]
+
+
+def test_quadrature_table():
+    table = gpio.QuadratureDecoder.TABLE
+    assert len(table) == 16
+    assert sum(delta for (_, delta, _) in table) == 0
+    assert sum(error for (_, _, error) in table) == 8
+
+
+def test_sim_counter(sim):
+    chip = sim.chip()
+    line = chip.request([14, 15], flags=["INPUT", "EDGE_RISING"])
+    counter = gpio.Counter(line)
+
+    for i in range(10):
+        sim.poke(14, 1)
+        sim.poke(14, 0)
+
+    sim.poke(15, 1)
+    counter.feed(line.read_events(64, 1))
+    snapshot = counter.snapshot()
+    assert snapshot[14]["count"] == 10
+    assert snapshot[15]["count"] == 1
+    assert snapshot[14]["frequency_hz"] == 0.0
+
+    with counter:
+        for i in range(10):
+            sim.poke(14, 1)
+            sim.poke(14, 0)
+            time.sleep(0.001)
+
+        time.sleep(0.05)
+
+    snapshot = counter.snapshot()
+    assert snapshot[14]["count"] == 20
+    assert 0 < snapshot[14]["frequency_hz"] < 1200
+
+
+def test_sim_quadrature_decoder(sim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = sim.chip()
+    line = chip.request([14, 15], flags=flags)
+    decoder = gpio.QuadratureDecoder(line, 14, 15)
+    forward = [(14, 1), (15, 1), (14, 0), (15, 0)]
+
+    for offset, value in forward * 3:
+        sim.poke(offset, value)
+
+    decoder.feed(line.read_events(64, 1))
+    assert decoder.snapshot()["position"] == 12
+
+    for offset, value in reversed(forward):
+        sim.poke(offset, 1 - value)
+        time.sleep(0.001)
+
+    decoder.feed(line.read_events(64, 1))
+    snapshot = decoder.snapshot()
+    assert snapshot["position"] == 8
+    assert snapshot["velocity"] < 0
+    assert snapshot["errors"] == snapshot["missed"] == 0
+
+
+def test_sim_quadrature_decoder_other_lines(sim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    chip = sim.chip()
+    line = chip.request([14, 15, 16], flags=flags)
+    decoder = gpio.QuadratureDecoder(line, 14, 15)
+
+    for offset, value in [(14, 1), (16, 1), (15, 1), (16, 0), (14, 0), (15, 0)]:
+        sim.poke(offset, value)
+
+    decoder.feed(line.read_events(64, 1))
+    snapshot = decoder.snapshot()
+    assert snapshot["position"] == 4
+    assert snapshot["errors"] == snapshot["missed"] == 0
+
+
+def test_debouncer():
+    debouncer = gpio.Debouncer({3: 1000}, levels={3: 0})
+    edges = [(100, 1), (300, 2), (500, 1), (5000, 2), (5100, 1)]
+    debouncer.feed(gpio.LineEvent(t, i, 3, n, n) for (n, (t, i)) in enumerate(edges))
+    debouncer.feed([gpio.LineEvent(6000, 1, 4, 7, 1)])
+
+    events = debouncer.take(16)
+    assert [(e.timestamp_ns, e.offset) for e in events] == [(500, 3), (6000, 4)]
+    assert debouncer.timeout() is None
+    assert debouncer.suppressed == 4
+
+
+def test_sim_software_debounce():
+    sim = gpio.Simulator(24, debounce=False)
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    attrs = [{"debounce_period_us": 20000, "mask": 0b01}]
+    chip = sim.chip()
+    line = chip.request([14, 15], flags=flags, attrs=attrs)
+    assert chip.info([14])["lines"][0]["attrs"] == []
+
+    for value in (1, 0, 1, 0, 1):
+        sim.poke(14, value)
+
+    sim.poke(15, 1)
+    event = line.wait(1)
+    assert event.offset == 15
+
+    start = time.monotonic()
+    event = line.wait(1)
+    assert event.offset == 14
+    assert event.id == gpio.LineEventId.RISING_EDGE
+    assert event.seqno == 5
+    assert time.monotonic() - start >= 0.01
+
+    sim.poke(14, 0)
+    sim.poke(14, 1)
+    assert line.read_events(16, 0.05) is None
+
+    sim.poke(14, 0)
+    event = asyncio.run(line.wait_async(1))
+    assert event.id == gpio.LineEventId.FALLING_EDGE
+
+
+def test_sim_software_debounce_selector_engines():
+    sim = gpio.Simulator(24, debounce=False)
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    attrs = [{"debounce_period_us": 10000, "mask": 0b1}]
+    chip = sim.chip()
+    line = chip.request([14], flags=flags, attrs=attrs)
+    received = []
+    selector = gpio.Selector()
+    selector.register(line, received.append)
+
+    for value in (1, 0, 1, 0, 1):
+        sim.poke(14, value)
+
+    start = time.monotonic()
+
+    while not received and time.monotonic() - start < 1:
+        selector.dispatch(1)
+
+    assert [(e.offset, e.id, e.seqno) for e in received] == [
+        (14, gpio.LineEventId.RISING_EDGE, 5)
+    ]
+    assert time.monotonic() - start >= 0.005
+    assert line._epoll is None
+    selector.close()
+
+    counter = gpio.Counter(line)
+
+    with counter:
+        for value in (0, 1, 0, 1, 0):
+            sim.poke(14, value)
+
+        time.sleep(0.05)
+
+    assert counter.snapshot()[14]["count"] == 1
+
+    with pytest.raises(AssertionError):
+        gpio.Capture(line).start()
+
+
+def test_sim_hardware_debounce(sim):
+    flags = ["INPUT", "EDGE_RISING", "EDGE_FALLING"]
+    attrs = [{"debounce_period_us": 20000, "mask": 0b01}]
+    line = sim.chip().request([14], flags=flags, attrs=attrs)
+    assert line._debouncer is None
+
+
+def test_sim_broker(sim, tmp_path):
+    chip = sim.chip()
+    out = chip.request([4, 5], flags=["OUTPUT"])
+    inp = chip.request([14], flags=["INPUT", "EDGE_RISING", "EDGE_FALLING"])
+    path = str(tmp_path / "gpio.sock")
+    broker = gpio.Broker(path, [out, inp])
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            broker.serve(0.01)
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+
+    try:
+        client = gpio.RemoteLines(path)
+        other = gpio.RemoteLines(path)
+        assert client.get() == {4: False, 5: False, 14: False}
+
+        client.subscribe([14])
+        client.set({4: True})
+        other.set_bits(0b10, 0b10)
+        assert other.get_bits(0b111) == 0b011
+        assert sim.peek(4) == 1 and sim.peek(5) == 1
+
+        sim.poke(14, 1)
+        event = client.wait(1)
+        assert event.offset == 14
+        assert event.id == gpio.LineEventId.RISING_EDGE
+        assert other.wait(0.05) is None
+
+        client.set({14: True})
+
+        with pytest.raises(OSError):
+            client.get_bits(0b100)
+
+        other.close()
+        client.close()
+    finally:
+        stop.set()
+        thread.join()
+        broker.close()
+
+
+def test_sim_broker_coalesce(sim, tmp_path):
+    out = sim.chip().request([4, 5, 6], flags=["OUTPUT"])
+    path = str(tmp_path / "gpio.sock")
+    metrics = out.instrument()
+
+    with gpio.Broker(path, [out]) as broker:
+        clients = []
+
+        for _ in range(2):
+            thread = threading.Thread(
+                target=lambda: clients.append(gpio.RemoteLines(path))
+            )
+            thread.start()
+            broker.serve(1)
+            thread.join()
+
+        for i in range(10):
+            clients[0].set_bits(i & 1, 0b001)
+
+        clients[1].set({5: True, 6: True})
+        clients[1].set({6: False})
+
+        while broker.serve(0):
+            pass
+
+        assert metrics.snapshot()["timings"]["GPIO_V2_LINE_SET_VALUES"]["count"] == 1
+        assert [sim.peek(k) for k in (4, 5, 6)] == [1, 1, 0]
+
+        for client in clients:
+            client.close()
+
+
+def test_sim_broker_bad_write(sim, tmp_path):
+    chip = sim.chip()
+    out = chip.request([4, 5], flags=["OUTPUT"])
+    inp = chip.request([14], flags=["INPUT"])
+    path = str(tmp_path / "gpio.sock")
+    broker = gpio.Broker(path, [out, inp])
+    thread = threading.Thread(target=broker.serve_forever)
+    thread.start()
+
+    try:
+        good = gpio.RemoteLines(path)
+        bad = gpio.RemoteLines(path)
+        good.set_bits(0b01, 0b01)
+        bad.set_bits(0b101, 0b101)
+        good.set_bits(0b10, 0b10)
+        assert good.get_bits(0b011) == 0b011
+        assert sim.peek(4) == 1 and sim.peek(5) == 1
+
+        with pytest.raises(OSError):
+            bad.get_bits(0b001)
+
+        assert bad.get_bits(0b011) == 0b011
+        bad.set_bits(0b101, 0b101)
+        bad.set_bits(0b000, 0b011)
+
+        with pytest.raises(OSError):
+            bad.get_bits(0b011)
+
+        assert bad.get_bits(0b011) == 0b000
+        assert good.get_bits(0b011) == 0b000
+        good.close()
+        bad.close()
+    finally:
+        broker.close()
+        thread.join(1)
+
+    assert not thread.is_alive()
+
+
+def test_sim_wait_async_after_events_break(sim):
+    chip = sim.chip()
+    line = chip.request([1], flags=["INPUT", "EDGE_RISING", "EDGE_FALLING"])
+
+    async def consume():
+        loop = asyncio.get_running_loop()
+
+        async for event in line.events():
+            break
+
+        loop.call_later(0.05, sim.poke, 1, 0)
+        start = loop.time()
+        event = await line.wait_async(1)
+        return event, loop.time() - start
+
+    sim.poke(1, 1)
+    event, elapsed = asyncio.run(consume())
+    assert event.id == gpio.LineEventId.FALLING_EDGE
+    assert elapsed < 0.5